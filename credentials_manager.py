@@ -1,19 +1,76 @@
 import os
 import json
+import atexit
+import functools
+import tempfile
+import threading
 import keyring
 from pathlib import Path
 import base64
 
+# Use orjson when installed, it is much faster than the stdlib json module
+try:
+    import orjson
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj, indent=2).encode()
+    
+    _json_loads = json.loads
+
+# Service name and account used for keyring
+SERVICE_NAME = "WawaChat"
+KEYRING_USERNAME = "huggingface_api_key"
+
+# Marks the API key cache as not yet populated (None is a valid cached value)
+_SENTINEL = object()
+
+@functools.lru_cache(maxsize=1)
+def _get_config_dir():
+    """Get the configuration directory path"""
+    home_dir = Path.home()
+    
+    if os.name == 'nt':  # Windows
+        config_dir = os.path.join(home_dir, "AppData", "Local", "WawaChat")
+    else:  # macOS, Linux, etc.
+        config_dir = os.path.join(home_dir, ".config", "wawachat")
+        
+    return config_dir
+
+@functools.lru_cache(maxsize=1)
+def _get_config_file():
+    """Get the configuration file path"""
+    return os.path.join(_get_config_dir(), "config.json")
+
 class CredentialsManager:
     """Manager for handling API credentials securely"""
     
-    # Service name used for keyring
-    SERVICE_NAME = "WawaChat"
+    # Service name used for keyring (module constant, kept here for callers)
+    SERVICE_NAME = SERVICE_NAME
+    
+    # Parsed config files shared across instances: path -> (mtime_ns, config)
+    _CACHE = {}
+    
+    # Configs with a write still pending: path -> config
+    _PENDING = {}
+    
+    # Instances with a write still pending, flushed at exit
+    _SCHEDULED = set()
+    
+    # Serializes config writes across instances and the exit flush
+    _WRITE_LOCK = threading.Lock()
+    
+    # Delay in seconds used to coalesce bursts of config changes into one write
+    SAVE_DELAY = 0.5
     
     def __init__(self):
         """Initialize the credentials manager"""
-        self.config_dir = self._get_config_dir()
-        self.config_file = os.path.join(self.config_dir, "config.json")
+        self.config_dir = _get_config_dir()
+        self.config_file = _get_config_file()
         self._ensure_config_dir()
         
         # Default configuration
@@ -23,20 +80,17 @@ class CredentialsManager:
             "first_run_completed": False
         }
         
+        # Pending write state for the debounced save
+        self._dirty = False
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+        
+        # API key as last read from or written to storage
+        self._cached_key = _SENTINEL
+        
         # Load configuration
         self.load_config()
     
-    def _get_config_dir(self):
-        """Get the configuration directory path"""
-        home_dir = Path.home()
-        
-        if os.name == 'nt':  # Windows
-            config_dir = os.path.join(home_dir, "AppData", "Local", "WawaChat")
-        else:  # macOS, Linux, etc.
-            config_dir = os.path.join(home_dir, ".config", "wawachat")
-            
-        return config_dir
-    
     def _ensure_config_dir(self):
         """Ensure the configuration directory exists"""
         if not os.path.exists(self.config_dir):
@@ -45,20 +99,89 @@ class CredentialsManager:
     def load_config(self):
         """Load configuration from file"""
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r') as f:
-                    loaded_config = json.load(f)
-                    self.config.update(loaded_config)
+            pending = self._PENDING.get(self.config_file)
+            if pending is not None:
+                # Another instance has changes that are not on disk yet
+                self.config.update(pending)
+                return
+            
+            try:
+                mtime_ns = os.stat(self.config_file).st_mtime_ns
+            except FileNotFoundError:
+                # No config saved yet, keep the defaults
+                return
+            
+            cached = self._CACHE.get(self.config_file)
+            if cached and cached[0] == mtime_ns:
+                # File unchanged since last read, skip the parse
+                self.config.update(cached[1])
+                return
+            
+            # Parse the whole small file at once rather than through a text stream
+            with open(self.config_file, 'rb') as f:
+                loaded_config = _json_loads(f.read())
+            self.config.update(loaded_config)
+            self._CACHE[self.config_file] = (mtime_ns, dict(loaded_config))
         except Exception as e:
             print(f"Error loading config: {e}")
     
     def save_config(self):
         """Save configuration to file"""
+        tmp_file = None
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            data = _json_dumps(self.config)
+            
+            with self._WRITE_LOCK:
+                # Write to a temp file of our own and swap it in so a crash never leaves torn JSON.
+                # No fsync: losing the latest change is recoverable, a corrupt file is not.
+                fd, tmp_file = tempfile.mkstemp(dir=self.config_dir, suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_file, self.config_file)
+                tmp_file = None
+                
+                # Keep the shared cache in step with what is now on disk
+                mtime_ns = os.stat(self.config_file).st_mtime_ns
+                self._CACHE[self.config_file] = (mtime_ns, dict(self.config))
         except Exception as e:
             print(f"Error saving config: {e}")
+            if tmp_file is not None:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+    
+    def _schedule_save(self):
+        """Mark the config dirty and write it once changes stop arriving"""
+        with self._save_lock:
+            self._dirty = True
+            self._PENDING[self.config_file] = self.config
+            self._SCHEDULED.add(self)
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            self._save_timer = threading.Timer(self.SAVE_DELAY, self._flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def _flush(self):
+        """Write the config now if there are unsaved changes"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            self._SCHEDULED.discard(self)
+            if not self._dirty:
+                return
+            self._dirty = False
+        self.save_config()
+        if self._PENDING.get(self.config_file) is self.config:
+            self._PENDING.pop(self.config_file, None)
+    
+    @classmethod
+    def _flush_all(cls):
+        """Write every config that still has unsaved changes"""
+        for manager in list(cls._SCHEDULED):
+            manager._flush()
     
     def set_api_key(self, api_key):
         """Store the API key either in keyring or config"""
@@ -68,13 +191,14 @@ class CredentialsManager:
                 
             if self.config.get("use_keyring", True):
                 # Store in system keyring
-                keyring.set_password(self.SERVICE_NAME, "huggingface_api_key", api_key)
+                keyring.set_password(self.SERVICE_NAME, KEYRING_USERNAME, api_key)
             else:
                 # Store in config file (less secure, but works everywhere)
                 self.config["encrypted_api_key"] = self._simple_encrypt(api_key)
             
             self.config["api_key_stored"] = True
-            self.save_config()
+            self._cached_key = api_key
+            self._schedule_save()
             return True, "API key saved successfully"
         except Exception as e:
             return False, f"Failed to store API key: {e}"
@@ -83,17 +207,23 @@ class CredentialsManager:
         """Retrieve the API key"""
         if not self.config.get("api_key_stored", False):
             return None
+        
+        # Avoid a keyring round-trip once the key is known
+        if self._cached_key is not _SENTINEL:
+            return self._cached_key
             
         try:
+            api_key = None
             if self.config.get("use_keyring", True):
                 # Get from system keyring
-                return keyring.get_password(self.SERVICE_NAME, "huggingface_api_key")
+                api_key = keyring.get_password(self.SERVICE_NAME, KEYRING_USERNAME)
             else:
                 # Get from config file
                 encrypted_key = self.config.get("encrypted_api_key")
                 if encrypted_key:
-                    return self._simple_decrypt(encrypted_key)
-            return None
+                    api_key = self._simple_decrypt(encrypted_key)
+            self._cached_key = api_key
+            return api_key
         except Exception as e:
             print(f"Error retrieving API key: {e}")
             return None
@@ -102,24 +232,30 @@ class CredentialsManager:
         """Delete the stored API key"""
         try:
             if self.config.get("use_keyring", True):
-                keyring.delete_password(self.SERVICE_NAME, "huggingface_api_key")
+                keyring.delete_password(self.SERVICE_NAME, KEYRING_USERNAME)
             
             if "encrypted_api_key" in self.config:
                 del self.config["encrypted_api_key"]
                 
             self.config["api_key_stored"] = False
-            self.save_config()
+            self._cached_key = _SENTINEL
+            self._schedule_save()
             return True, "API key deleted successfully"
         except Exception as e:
             return False, f"Failed to delete API key: {e}"
     
     def set_keyring_preference(self, use_keyring):
         """Set whether to use system keyring or config file"""
+        # Nothing to migrate, skip the keyring read and write
+        if self.config.get("use_keyring", True) == use_keyring:
+            return True, "Storage preference unchanged"
+
         # If changing from file storage to keyring or vice versa, and key exists, migrate it
         current_key = self.get_api_key()
         
         self.config["use_keyring"] = use_keyring
-        self.save_config()
+        self._cached_key = _SENTINEL
+        self._schedule_save()
         
         if current_key and self.config.get("api_key_stored", False):
             # Re-save the key with the new storage method
@@ -130,7 +266,7 @@ class CredentialsManager:
     def mark_first_run_completed(self):
         """Mark the first run wizard as completed"""
         self.config["first_run_completed"] = True
-        self.save_config()
+        self._schedule_save()
     
     def is_first_run(self):
         """Check if this is the first time running the app"""
@@ -143,11 +279,15 @@ class CredentialsManager:
     def _simple_encrypt(self, text):
         """Very simple obfuscation (not secure, just to avoid plaintext)"""
         # This is not secure encryption, just basic obfuscation
-        return base64.b64encode(text.encode()).decode()
+        return base64.b64encode(text.encode()).decode("ascii")
     
     def _simple_decrypt(self, encoded_text):
         """Reverse the simple obfuscation"""
         try:
-            return base64.b64decode(encoded_text.encode()).decode()
+            # b64decode accepts the ASCII str directly, no need to encode it first
+            return base64.b64decode(encoded_text).decode()
         except:
             return None
+
+# Make sure pending writes still land on shutdown (registered once, not per instance)
+atexit.register(CredentialsManager._flush_all)
@@ -6,6 +6,13 @@ import threading
 import sys
 
 class FirstRunWizard:
+    # Resized logo image, shared by all wizard instances (also keeps it referenced)
+    _LOGO_CACHE = None
+    
+    # Fixed dialog size, also used to center it without a geometry round-trip
+    WIDTH = 600
+    HEIGHT = 450
+    
     def __init__(self, parent, credentials_manager, on_complete=None):
         self.parent = parent
         self.credentials_manager = credentials_manager
@@ -14,6 +21,9 @@ class FirstRunWizard:
         # Current step in the wizard (0-based index)
         self.current_step = 0
         
+        # Page frames already built, by step index, reused on revisits
+        self.step_frames = {}
+        
         # Define the wizard steps
         self.steps = [
             {
@@ -40,7 +50,7 @@ class FirstRunWizard:
         """Create the wizard dialog"""
         self.dialog = tk.Toplevel(self.parent)
         self.dialog.title("WawaChat Setup Wizard")
-        self.dialog.geometry("600x450")
+        self.dialog.geometry(f"{self.WIDTH}x{self.HEIGHT}")
         self.dialog.resizable(False, False)
         
         # Make it modal
@@ -74,10 +84,8 @@ class FirstRunWizard:
         self.next_button = ttk.Button(self.nav_bar, text="Next", command=self._handle_next)
         self.next_button.pack(side=tk.RIGHT, padx=5)
         
-        # Center the wizard
-        self.dialog.update_idletasks()
-        w = self.dialog.winfo_width()
-        h = self.dialog.winfo_height()
+        # Center the wizard (size is fixed, so no need to wait for layout)
+        w, h = self.WIDTH, self.HEIGHT
         x = self.parent.winfo_x() + (self.parent.winfo_width() - w) // 2
         y = self.parent.winfo_y() + (self.parent.winfo_height() - h) // 2
         self.dialog.geometry(f"{w}x{h}+{x}+{y}")
@@ -90,17 +98,22 @@ class FirstRunWizard:
         if step_index < 0 or step_index >= len(self.steps):
             return
             
+        # Hide the current page, keeping its widgets for later
+        current_frame = self.step_frames.get(self.current_step)
+        if current_frame is not None:
+            current_frame.pack_forget()
+        
         self.current_step = step_index
         
         # Update title
         self.title_label.config(text=self.steps[step_index]["title"])
         
-        # Clear current content
-        for widget in self.content_frame.winfo_children():
-            widget.destroy()
-        
-        # Create new content
-        self.steps[step_index]["content"](self.content_frame)
+        # Show the page, building it on the first visit only
+        frame = self.step_frames.get(step_index)
+        if frame is None:
+            self.step_frames[step_index] = self.steps[step_index]["content"](self.content_frame)
+        else:
+            frame.pack(fill=tk.BOTH, expand=True)
         
         # Update navigation buttons
         self._update_nav_buttons()
@@ -177,20 +190,29 @@ class FirstRunWizard:
         else:
             self.api_key_entry.config(show="•")
     
+    def _open_url(self, url):
+        """Open a URL in the browser without blocking the UI"""
+        # Launching the browser can block for a noticeable time (e.g. LaunchServices on macOS)
+        threading.Thread(target=webbrowser.open_new, args=(url,), daemon=True).start()
+    
     def _create_welcome_page(self, parent):
         """Create the welcome page content"""
         frame = ttk.Frame(parent)
         frame.pack(fill=tk.BOTH, expand=True)
         
-        # Try to load the logo if it exists
+        # Try to load the logo if it exists, decoding it only once per process
         try:
-            logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
-            if os.path.exists(logo_path):
-                from PIL import Image, ImageTk
-                img = Image.open(logo_path)
-                img = img.resize((150, 150), Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.ANTIALIAS)
-                logo = ImageTk.PhotoImage(img)
-                
+            logo = FirstRunWizard._LOGO_CACHE
+            if logo is None:
+                logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
+                if os.path.exists(logo_path):
+                    from PIL import Image, ImageTk
+                    img = Image.open(logo_path)
+                    img = img.resize((150, 150), Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.ANTIALIAS)
+                    logo = ImageTk.PhotoImage(img)
+                    FirstRunWizard._LOGO_CACHE = logo
+            
+            if logo is not None:
                 logo_label = ttk.Label(frame, image=logo)
                 logo_label.image = logo  # Keep a reference to prevent garbage collection
                 logo_label.pack(pady=20)
@@ -206,6 +228,8 @@ class FirstRunWizard:
             "Click 'Next' to continue."
         )
         ttk.Label(frame, text=welcome_text, wraplength=500, justify=tk.CENTER).pack(pady=20)
+        
+        return frame
     
     def _create_api_key_page(self, parent):
         """Create the API key page content"""
@@ -244,12 +268,14 @@ class FirstRunWizard:
         ttk.Label(get_key_frame, text="Don't have an API key?").grid(row=0, column=0, padx=5)
         
         get_key_button = ttk.Button(get_key_frame, text="Get Key from Hugging Face", 
-                                  command=lambda: webbrowser.open_new("https://huggingface.co/settings/tokens"))
+                                  command=lambda: self._open_url("https://huggingface.co/settings/tokens"))
         get_key_button.grid(row=0, column=1)
         
         # Skip info
         skip_text = "You can also skip this step and add your API key later in Preferences."
         ttk.Label(frame, text=skip_text, wraplength=500, foreground="gray").pack(pady=20)
+        
+        return frame
     
     def _create_models_page(self, parent):
         """Create the models page content"""
@@ -283,13 +309,15 @@ class FirstRunWizard:
         storage_frame.pack(pady=10, fill=tk.X)
         
         try:
-            import huggingface_hub
-            cache_dir = huggingface_hub.constants.HUGGINGFACE_HUB_CACHE
+            from model_manager import get_hf_cache_dir
+            cache_dir = get_hf_cache_dir()
             ttk.Label(storage_frame, text=f"Models will be stored in:\n{cache_dir}", 
                    wraplength=500).pack(padx=5, pady=5)
         except:
             ttk.Label(storage_frame, text="Models will be stored in the default Hugging Face cache directory.",
                    wraplength=500).pack(padx=5, pady=5)
+        
+        return frame
     
     def _create_complete_page(self, parent):
         """Create the setup complete page content"""
@@ -317,3 +345,5 @@ class FirstRunWizard:
         
         for i, tip in enumerate(tips):
             ttk.Label(tips_frame, text=f"• {tip}", wraplength=450).pack(anchor=tk.W, padx=5, pady=2)
+        
+        return frame
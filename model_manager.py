@@ -1,18 +1,82 @@
 import os
+import sys
+import platform
 import shutil
+import subprocess
 import json
+import tempfile
+import time
+import operator
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import huggingface_hub
-from huggingface_hub import scan_cache_dir
+
+# Use orjson when installed, it is much faster than the stdlib json module
+try:
+    import orjson
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj, indent=2)
+    
+    _json_loads = json.loads
+
+# On-disk index of the last cache scan, reused while the cache is unchanged
+MODEL_INDEX_FILE = os.path.join(str(Path.home()), ".cache", "wawachat", "model_index.json")
+
+# Model fields the index can serve; "files" needs a live scan
+INDEX_FIELDS = frozenset({"repo_id", "revision", "size_mb", "last_modified"})
+
+# Guards the index file and every manager's in-memory copy; scans run on several threads
+_index_lock = threading.Lock()
+
+# Thread pool for walking cache directories in parallel, shared by all managers
+_size_executor = None
+_size_executor_lock = threading.Lock()
+
+def _get_size_executor():
+    """Create the shared cache walking pool on first use"""
+    global _size_executor
+    with _size_executor_lock:
+        if _size_executor is None:
+            # Walking is I/O bound, more threads than cores keeps the disk queue busy
+            _size_executor = ThreadPoolExecutor(
+                max_workers=min(8, (os.cpu_count() or 1) * 2),
+                thread_name_prefix="cache-size")
+        return _size_executor
+
+# Reads all per-revision attributes in one C-level call
+_rev_attrs = operator.attrgetter('commit_hash', 'size_on_disk', 'last_modified', 'files')
 
 class ModelManager:
     """Utility class to manage downloaded models and cache"""
     
+    # huggingface_hub module, imported on first use since it is slow to load
+    _hf_hub = None
+    
+    # Seconds a cache scan result is reused before rescanning
+    CACHE_INFO_TTL = 5.0
+    
     def __init__(self):
+        # Last scan_cache_dir result and when it was taken
+        self._cache_info_cached = None
+        self._cache_info_ts = 0
+        
+        # Fallback sizes of top-level cache directories: path -> (fingerprint, bytes)
+        self._size_cache = {}
+        
+        # Contents of MODEL_INDEX_FILE, loaded on first use
+        self._index = None
+        
         # Get the default Hugging Face cache directory
         try:
             # Use the proper function to get the cache dir
-            self.cache_dir = huggingface_hub.constants.HUGGINGFACE_HUB_CACHE
+            self.cache_dir = get_hf_cache_dir()
             
             # If not set, get from environment variable
             if not self.cache_dir:
@@ -44,114 +108,342 @@ class ModelManager:
             self.cache_dir = str(home / ".cache" / "huggingface")
             os.makedirs(self.cache_dir, exist_ok=True)
     
+    @classmethod
+    def _get_hf_hub(cls):
+        """Import huggingface_hub lazily and keep the module reference"""
+        if cls._hf_hub is None:
+            import huggingface_hub
+            cls._hf_hub = huggingface_hub
+        return cls._hf_hub
+    
     def get_cache_info(self):
         """Get information about the cache directory"""
+        # Reuse a recent scan, the full tree walk is expensive
+        if (self._cache_info_cached is not None
+                and time.monotonic() - self._cache_info_ts < self.CACHE_INFO_TTL):
+            return self._cache_info_cached
+        
         try:
-            cache_info = scan_cache_dir(self.cache_dir)
+            # Fingerprint before scanning so changes made during the scan
+            # show up as a mismatch next time
+            fingerprint = self._fingerprint_cache()
+            cache_info = self._get_hf_hub().scan_cache_dir(self.cache_dir)
+            self._cache_info_cached = cache_info
+            self._cache_info_ts = time.monotonic()
+            self._save_index(fingerprint, cache_info)
             return cache_info
         except Exception as e:
             print(f"Error scanning cache directory: {e}")
             return None
     
-    def get_downloaded_models(self):
-        """Get a list of downloaded models with size information"""
+    def _fingerprint_cache(self):
+        """Collect directory mtimes that change whenever a cached repo changes"""
+        fingerprint = {}
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if "--" in entry.name and entry.is_dir(follow_symlinks=False):
+                    fingerprint[entry.name] = self._fingerprint_dir(entry)
+        return fingerprint
+    
+    def _fingerprint_dir(self, entry):
+        """Map a top-level cache directory and its key subdirectories to their mtimes"""
+        # Downloads and deletions touch blobs/, refs/ or a snapshot directory,
+        # so these stats stand in for walking every file
+        stamps = {"": entry.stat(follow_symlinks=False).st_mtime_ns}
+        for sub in ("blobs", "refs", "snapshots"):
+            try:
+                stamps[sub] = os.stat(os.path.join(entry.path, sub)).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        
+        if "snapshots" in stamps:
+            try:
+                with os.scandir(os.path.join(entry.path, "snapshots")) as snapshots:
+                    for snapshot in snapshots:
+                        stamps["snapshots/" + snapshot.name] = snapshot.stat(follow_symlinks=False).st_mtime_ns
+            except OSError:
+                # Not a directory after all, the mtime above still covers it
+                pass
+        return stamps
+    
+    def _index_header(self):
+        """Describe what produced the index, so upgrades invalidate it"""
+        return {
+            "version": 1,
+            "python": platform.python_version(),
+            "huggingface_hub": getattr(self._get_hf_hub(), "__version__", "unknown"),
+            "cache_dir": self.cache_dir,
+        }
+    
+    def _save_index(self, fingerprint, cache_info):
+        """Write the models and total size from a fresh scan to the index file"""
+        tmp_file = None
+        try:
+            index = {
+                "header": self._index_header(),
+                "fingerprint": fingerprint,
+                "size_on_disk": getattr(cache_info, 'size_on_disk', None),
+                "models": list(self._iter_models(cache_info, INDEX_FIELDS.__contains__)),
+            }
+            data = _json_dumps(index)
+            
+            # Same temp file + rename approach as the config, never leave a torn index;
+            # each writer gets its own temp file
+            os.makedirs(os.path.dirname(MODEL_INDEX_FILE), exist_ok=True)
+            with _index_lock:
+                self._index = index
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(MODEL_INDEX_FILE), suffix=".tmp")
+                with os.fdopen(fd, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_file, MODEL_INDEX_FILE)
+                tmp_file = None
+        except Exception as e:
+            print(f"Error saving model index: {e}")
+            if tmp_file is not None:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+    
+    def _get_valid_index(self):
+        """Return the index if it still matches the cache on disk, otherwise None"""
         try:
+            with _index_lock:
+                if self._index is None:
+                    try:
+                        with open(MODEL_INDEX_FILE, 'rb') as f:
+                            self._index = _json_loads(f.read())
+                    except FileNotFoundError:
+                        return None
+                index = self._index
+            
+            if (index.get("header") != self._index_header()
+                    or index.get("fingerprint") != self._fingerprint_cache()):
+                return None
+            return index
+        except Exception as e:
+            print(f"Error reading model index: {e}")
+            return None
+    
+    def iter_downloaded_models(self, fields=None):
+        """Yield downloaded models with size information one revision at a time"""
+        # If a set of field names is given, only those keys are computed per model
+        wants = (lambda key: True) if fields is None else fields.__contains__
+        
+        try:
+            # Serve from the index when it has every requested field and is current
+            if fields is not None and INDEX_FIELDS.issuperset(fields):
+                index = self._get_valid_index()
+                if index is not None:
+                    for model in index["models"]:
+                        yield {k: v for k, v in model.items() if wants(k) or k == "error"}
+                    return
+            
             cache_info = self.get_cache_info()
             if not cache_info:
-                return []
-                
-            models = []
+                return
             
-            # Iterate through repositories
-            for repo in cache_info.repos:
-                if hasattr(repo, 'revisions'):
-                    for rev in repo.revisions:
-                        try:
-                            # Get revision identifier from commit_hash attribute
-                            revision = getattr(rev, 'commit_hash', "unknown")
-                            
-                            # Get size directly from the size_on_disk attribute
-                            size_mb = getattr(rev, 'size_on_disk', 0) / (1024 * 1024)
-                            
-                            # Get last_modified directly
-                            last_modified = getattr(rev, 'last_modified', None)
-                            
-                            # Get file information if available
-                            files = []
-                            if hasattr(rev, 'files'):
-                                files = rev.files
-                            
-                            models.append({
-                                "repo_id": repo.repo_id,
-                                "revision": revision,
-                                "size_mb": round(size_mb, 2),
-                                "last_modified": last_modified.isoformat() if last_modified else "Unknown",
-                                "files": files
-                            })
-                        except Exception as e:
-                            # Add minimal info if we encounter an error
-                            models.append({
-                                "repo_id": repo.repo_id,
-                                "revision": "unknown",
-                                "size_mb": 0,
-                                "last_modified": "Unknown",
-                                "error": str(e)
-                            })
-            return models
+            yield from self._iter_models(cache_info, wants)
         except Exception as e:
             print(f"Error getting downloaded models: {e}")
-            return []
+    
+    def _iter_models(self, cache_info, wants):
+        """Yield a model dict per cached revision with the fields wants() accepts"""
+        # Iterate through repositories
+        for repo in cache_info.repos:
+            if hasattr(repo, 'revisions'):
+                for rev in repo.revisions:
+                    try:
+                        # A revision missing any of these falls through to the error entry
+                        revision, size_on_disk, last_modified, files = _rev_attrs(rev)
+                        model = {}
+                        
+                        if wants("repo_id"):
+                            model["repo_id"] = repo.repo_id
+                        
+                        if wants("revision"):
+                            model["revision"] = revision
+                        
+                        if wants("size_mb"):
+                            model["size_mb"] = round(size_on_disk / (1024 * 1024), 2)
+                        
+                        if wants("last_modified"):
+                            # Formatting dates is comparatively slow, so only done on request
+                            model["last_modified"] = last_modified.isoformat() if last_modified else "Unknown"
+                        
+                        if wants("files"):
+                            model["files"] = files
+                        
+                        yield model
+                    except Exception as e:
+                        # Add minimal info if we encounter an error
+                        minimal = {
+                            "repo_id": repo.repo_id,
+                            "revision": "unknown",
+                            "size_mb": 0,
+                            "last_modified": "Unknown",
+                        }
+                        model = {k: v for k, v in minimal.items() if wants(k)}
+                        model["error"] = str(e)
+                        yield model
+    
+    def get_downloaded_models(self, fields=None):
+        """Get a list of downloaded models with size information"""
+        return list(self.iter_downloaded_models(fields))
     
     def get_total_cache_size(self):
         """Get the total size of the cache in MB"""
         try:
+            # Nothing changed since the last scan, use its recorded size
+            index = self._get_valid_index()
+            if index is not None and index.get("size_on_disk") is not None:
+                return round(index["size_on_disk"] / (1024 * 1024), 2)  # Convert to MB
+            
             # Use the size_on_disk attribute of cache_info directly
             cache_info = self.get_cache_info()
             if cache_info and hasattr(cache_info, 'size_on_disk'):
                 return round(cache_info.size_on_disk / (1024 * 1024), 2)  # Convert to MB
             
-            # Fall back to manual calculation if the above doesn't work
+            # Fall back to manual calculation if the above doesn't work,
+            # only walking top-level directories that changed since last time
             total_bytes = 0
-            for dirpath, _, filenames in os.walk(self.cache_dir):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if os.path.exists(fp):
-                        total_bytes += os.path.getsize(fp)
+            stale = []
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stamps = self._fingerprint_dir(entry)
+                        cached = self._size_cache.get(entry.path)
+                        if cached and cached[0] == stamps:
+                            total_bytes += cached[1]
+                        else:
+                            stale.append((entry.path, stamps))
+                    elif entry.is_file(follow_symlinks=False):
+                        total_bytes += entry.stat(follow_symlinks=False).st_size
+            
+            # Walk the changed directories concurrently
+            if stale:
+                sizes = _get_size_executor().map(self._get_dir_size, [path for path, _ in stale])
+                for (path, stamps), size in zip(stale, sizes):
+                    self._size_cache[path] = (stamps, size)
+                    total_bytes += size
             
             return round(total_bytes / (1024 * 1024), 2)  # Convert to MB
         except Exception as e:
             print(f"Error calculating cache size: {e}")
             return 0
     
+    def _get_dir_size(self, path):
+        """Recursively sum the size of regular files under path in bytes"""
+        return sum(self._walk_file_sizes(path))
+    
+    def _walk_file_sizes(self, path):
+        """Yield the size of every regular file under path"""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk_file_sizes(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        # Snapshot symlinks point at blobs, so only real files are counted
+                        yield entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    # Entry vanished or is unreadable, skip it
+                    pass
+    
+    def _invalidate_cache_info(self):
+        """Forget the last cache scan so the next call rescans"""
+        self._cache_info_cached = None
+        self._cache_info_ts = 0
+        self._size_cache.clear()
+        
+        # The fingerprint would catch the change too, but there is no point keeping it
+        with _index_lock:
+            self._index = None
+            try:
+                os.remove(MODEL_INDEX_FILE)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing model index: {e}")
+    
     def delete_model(self, repo_id, revision=None):
         """Delete a specific model from the cache"""
         try:
-            huggingface_hub.delete_from_cache(repo_id, revision=revision)
+            self._get_hf_hub().delete_from_cache(repo_id, revision=revision)
             return True, f"Successfully deleted {repo_id} ({revision})"
         except Exception as e:
             return False, f"Error deleting model: {e}"
+        finally:
+            self._invalidate_cache_info()
     
     def clear_entire_cache(self):
         """Clear the entire cache directory"""
         try:
             if os.path.exists(self.cache_dir):
-                shutil.rmtree(self.cache_dir)
+                # Move the tree aside (atomic on the same filesystem) so the cache
+                # is empty right away, then delete the old tree in the background
+                trash_path = f"{self.cache_dir}.trash.{os.getpid()}.{time.time_ns()}"
+                os.rename(self.cache_dir, trash_path)
                 os.makedirs(self.cache_dir)
+                threading.Thread(target=self._purge_trash, daemon=True).start()
             return True, "Cache cleared successfully"
         except Exception as e:
             return False, f"Error clearing cache: {e}"
+        finally:
+            self._invalidate_cache_info()
+    
+    def _purge_trash(self):
+        """Delete cache trees moved aside by clear_entire_cache, including leftovers"""
+        parent, name = os.path.split(os.path.normpath(self.cache_dir))
+        prefix = name + ".trash."
+        try:
+            with os.scandir(parent) as entries:
+                trash_paths = [e.path for e in entries if e.name.startswith(prefix)]
+        except OSError as e:
+            print(f"Error listing cache trash: {e}")
+            return
+        
+        for trash_path in trash_paths:
+            if sys.platform == 'darwin':
+                # rm uses removefile(3) on macOS, much faster than rmtree's per-file Python loop
+                subprocess.run(["/bin/rm", "-rf", trash_path], check=False)
+            else:
+                shutil.rmtree(trash_path, ignore_errors=True)
     
     def export_models_info(self, file_path):
         """Export information about downloaded models to a JSON file"""
+        # The same columns the model list shows (a revision's "files" are not JSON serializable)
+        return self.export_models_info_from_rows(file_path, self.iter_downloaded_models(fields=INDEX_FIELDS))
+    
+    def export_models_info_from_rows(self, file_path, rows):
+        """Export already collected model information (any iterable of dicts) to a JSON file"""
         try:
-            models = self.get_downloaded_models()
-            with open(file_path, 'w') as f:
-                json.dump(models, f, indent=2)
+            # Write one model at a time through a large buffer instead of
+            # building the whole list first; output matches json.dump(indent=2)
+            with open(file_path, 'w', buffering=1 << 20) as f:
+                f.write("[")
+                first = True
+                for model in rows:
+                    f.write("\n  " if first else ",\n  ")
+                    f.write(_json_dumps(model).replace("\n", "\n  "))
+                    first = False
+                f.write("]" if first else "\n]")
             return True, f"Model information exported to {file_path}"
         except Exception as e:
+            # Don't leave a half-written export behind
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
             return False, f"Error exporting model information: {e}"
 
 
+@functools.lru_cache(maxsize=1)
+def get_hf_cache_dir():
+    """Get the Hugging Face hub cache directory"""
+    return ModelManager._get_hf_hub().constants.HUGGINGFACE_HUB_CACHE
+
+
 if __name__ == "__main__":
     # Example usage
     manager = ModelManager()
@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import threading
+import queue
 import time
 import os
 from model_manager import ModelManager
@@ -8,12 +9,76 @@ from model_manager import ModelManager
 class ModelManagerUI:
     """UI component for managing Hugging Face models cache"""
     
+    # Tcl lambda that inserts many treeview rows in one call, avoiding a
+    # Python/Tcl round-trip per row. Takes the tree path and a flat list of
+    # text/values/tags triples, returns the new item ids.
+    _INSERT_ROWS_TCL = (
+        "{tree rows} {"
+        "set ids {}; "
+        "foreach {text values tags} $rows {"
+        "lappend ids [$tree insert {} end -text $text -values $values -tags $tags]"
+        "}; "
+        "return $ids"
+        "}"
+    )
+    
+    # How often queued UI updates from worker threads are applied (ms)
+    PUMP_INTERVAL_MS = 30
+    
+    # Models handed to the treeview per queued update while loading
+    LOAD_BATCH_SIZE = 16
+    
+    # Quiet period after a delete/clear before the list is reloaded (ms)
+    RELOAD_DELAY_MS = 250
+    
+    # Treeview data columns, hidden while a batch of rows is inserted
+    DISPLAY_COLUMNS = ("size", "revision", "modified")
+    
     def __init__(self, parent):
         self.parent = parent
         self.model_manager = ModelManager()
+        
+        # Callbacks from worker threads, run on the main thread by _pump
+        self._ui_queue = queue.Queue()
+        
+        # Incremented by every load_models call
+        self._load_generation = 0
+        
+        # Pending after() id of a debounced reload
+        self._reload_pending = None
+        
+        # Rows currently in the tree: (repo_id, revision) -> (item id, values)
+        self._row_index = {}
+        
+        # Models from the last completed load, reused by Export Info
+        self._last_models = None
+        
         self.create_window()
+        self._pump()
         self.load_models()
     
+    def _run_on_ui(self, callback):
+        """Queue a callback to run on the Tk main thread (safe from any thread)"""
+        self._ui_queue.put(callback)
+    
+    def _pump(self):
+        """Run all queued UI callbacks, then check again after a short interval"""
+        # Stop once the window is closed, its widgets are gone
+        if not self.window.winfo_exists():
+            return
+        
+        while True:
+            try:
+                callback = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error updating model manager UI: {e}")
+        
+        self.window.after(self.PUMP_INTERVAL_MS, self._pump)
+    
     def create_window(self):
         # Create a new top-level window
         self.window = tk.Toplevel(self.parent)
@@ -53,7 +118,7 @@ class ModelManagerUI:
         models_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         # Create a treeview for the models list
-        self.tree = ttk.Treeview(models_frame, columns=("size", "revision", "modified"), show="headings")
+        self.tree = ttk.Treeview(models_frame, columns=self.DISPLAY_COLUMNS, show="headings")
         self.tree.heading("size", text="Size (MB)")
         self.tree.heading("revision", text="Revision")
         self.tree.heading("modified", text="Last Modified")
@@ -92,14 +157,25 @@ class ModelManagerUI:
     def load_models(self):
         """Load model information in a background thread to keep UI responsive"""
         self.status_var.set("Loading models...")
-        self.tree.delete(*self.tree.get_children())  # Clear the treeview
         
-        def update_ui_with_models(models):
-            for model in models:
-                self.tree.insert("", tk.END, text=model["repo_id"], 
-                               values=(model["size_mb"], model["revision"], model["last_modified"]),
-                               tags=(model["repo_id"], model["revision"]))
-            self.status_var.set(f"Loaded {len(models)} models")
+        # Rows from an older load still in flight are dropped
+        self._load_generation += 1
+        generation = self._load_generation
+        
+        # Existing rows are kept and updated in place; rows not seen again are removed at the end
+        seen = set()
+        
+        def insert_batch(batch):
+            if generation == self._load_generation:
+                self._merge_rows(batch, seen)
+        
+        def finish_loading(models):
+            if generation == self._load_generation:
+                stale = [key for key in self._row_index if key not in seen]
+                if stale:
+                    self.tree.delete(*[self._row_index.pop(key)[0] for key in stale])
+                self._last_models = models
+                self.status_var.set(f"Loaded {len(models)} models")
         
         def update_cache_size(size):
             self.total_size_label.config(text=f"{size} MB")
@@ -107,14 +183,76 @@ class ModelManagerUI:
         def load_data():
             # Get the cache size
             size = self.model_manager.get_total_cache_size()
-            self.window.after(0, lambda: update_cache_size(size))
+            self._run_on_ui(lambda: update_cache_size(size))
             
-            # Get the models list
-            models = self.model_manager.get_downloaded_models()
-            self.window.after(0, lambda: update_ui_with_models(models))
+            # Stream the models list into the treeview a batch at a time
+            models = []
+            batch = []
+            for model in self.model_manager.iter_downloaded_models(
+                    fields={"repo_id", "revision", "size_mb", "last_modified"}):
+                models.append(model)
+                batch.append(model)
+                if len(batch) >= self.LOAD_BATCH_SIZE:
+                    self._run_on_ui(lambda batch=batch: insert_batch(batch))
+                    batch = []
+            if batch:
+                self._run_on_ui(lambda batch=batch: insert_batch(batch))
+            self._run_on_ui(lambda: finish_loading(models))
         
         threading.Thread(target=load_data, daemon=True).start()
     
+    def _schedule_reload(self):
+        """Reload the list once, shortly after the last of several changes"""
+        if self._reload_pending is not None:
+            self.window.after_cancel(self._reload_pending)
+        self._reload_pending = self.window.after(self.RELOAD_DELAY_MS, self._run_scheduled_reload)
+    
+    def _run_scheduled_reload(self):
+        """Run the reload set up by _schedule_reload"""
+        self._reload_pending = None
+        self.load_models()
+    
+    def _merge_rows(self, models, seen):
+        """Update rows that changed and insert new ones, recording their keys in seen"""
+        new_rows = []
+        for model in models:
+            key = (model["repo_id"], model["revision"])
+            if key in seen:
+                continue
+            seen.add(key)
+            
+            values = (model["size_mb"], model["revision"], model["last_modified"])
+            row = self._row_index.get(key)
+            if row is None:
+                new_rows.append((key, values, model))
+            elif row[1] != values:
+                self.tree.item(row[0], values=values)
+                self._row_index[key] = (row[0], values)
+        
+        item_ids = self._insert_rows([model for _, _, model in new_rows])
+        for (key, values, _), item_id in zip(new_rows, item_ids):
+            self._row_index[key] = (item_id, values)
+    
+    def _insert_rows(self, models):
+        """Append a row per model to the treeview with a single Tcl call"""
+        rows = []
+        for model in models:
+            rows.extend((
+                model["repo_id"],
+                (model["size_mb"], model["revision"], model["last_modified"]),
+                (model["repo_id"], model["revision"]),
+            ))
+        if not rows:
+            return ()
+        
+        # Hide the data columns so Tk does not lay them out again for every row
+        self.tree.configure(displaycolumns=())
+        try:
+            item_ids = self.tree.tk.call("apply", self._INSERT_ROWS_TCL, self.tree, tuple(rows))
+        finally:
+            self.tree.configure(displaycolumns=self.DISPLAY_COLUMNS)
+        return self.tree.tk.splitlist(item_ids)
+    
     def delete_selected(self):
         """Delete the selected model from the cache"""
         selection = self.tree.selection()
@@ -129,15 +267,24 @@ class ModelManagerUI:
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {repo_id}?"):
             self.status_var.set(f"Deleting {repo_id}...")
             
+            item_id = selection[0]
+            
             def do_delete():
-                success, msg = self.model_manager.delete_model(repo_id, revision)
-                if success:
-                    self.window.after(0, lambda: self.tree.delete(selection[0]))
-                self.window.after(0, lambda: self.status_var.set(msg))
-                self.window.after(1000, self.load_models)  # Reload after a delay
+                result = self.model_manager.delete_model(repo_id, revision)
+                self._run_on_ui(lambda: self._apply_delete_result(result, item_id))
             
             threading.Thread(target=do_delete, daemon=True).start()
     
+    def _apply_delete_result(self, result, item_id):
+        """Show the outcome of a delete and reload the list (main thread only)"""
+        success, msg = result
+        if success and self.tree.exists(item_id):
+            self.tree.delete(item_id)
+            self._row_index = {key: row for key, row in self._row_index.items() if row[0] != item_id}
+            self._last_models = None
+        self.status_var.set(msg)
+        self._schedule_reload()
+    
     def export_info(self):
         """Export model information to a JSON file"""
         filepath = filedialog.asksaveasfilename(
@@ -148,12 +295,23 @@ class ModelManagerUI:
         if filepath:
             self.status_var.set("Exporting model information...")
             
+            # Export what is already listed rather than scanning the cache again
+            rows = self._last_models
+            
             def do_export():
-                success, msg = self.model_manager.export_models_info(filepath)
-                self.window.after(0, lambda: self.status_var.set(msg))
+                if rows is not None:
+                    result = self.model_manager.export_models_info_from_rows(filepath, rows)
+                else:
+                    result = self.model_manager.export_models_info(filepath)
+                self._run_on_ui(lambda: self._apply_export_result(result))
             
             threading.Thread(target=do_export, daemon=True).start()
     
+    def _apply_export_result(self, result):
+        """Show the outcome of an export (main thread only)"""
+        success, msg = result
+        self.status_var.set(msg)
+    
     def clear_cache(self):
         """Clear the entire model cache"""
         if messagebox.askyesno("Confirm Clear Cache", 
@@ -161,11 +319,17 @@ class ModelManagerUI:
             self.status_var.set("Clearing cache...")
             
             def do_clear():
-                success, msg = self.model_manager.clear_entire_cache()
-                self.window.after(0, lambda: self.status_var.set(msg))
-                self.window.after(1000, self.load_models)  # Reload after a delay
+                result = self.model_manager.clear_entire_cache()
+                self._run_on_ui(lambda: self._apply_clear_result(result))
             
             threading.Thread(target=do_clear, daemon=True).start()
+    
+    def _apply_clear_result(self, result):
+        """Show the outcome of clearing the cache and reload the list (main thread only)"""
+        success, msg = result
+        self._last_models = None
+        self.status_var.set(msg)
+        self._schedule_reload()
 
 # For testing the UI directly
 if __name__ == "__main__":
@@ -2,11 +2,28 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import webbrowser
 import os
+import threading
+import functools
+
+@functools.lru_cache(maxsize=1)
+def _hf_hub():
+    """Import huggingface_hub once; it is slow to load the first time"""
+    import huggingface_hub
+    return huggingface_hub
+
+def _prewarm_hf_hub():
+    """Load huggingface_hub in the background so Test Connection starts quickly"""
+    try:
+        _hf_hub()
+    except ImportError:
+        # Reported when the user actually tests the key
+        pass
 
 class PreferencesDialog:
     def __init__(self, parent, credentials_manager):
         self.parent = parent
         self.credentials_manager = credentials_manager
+        threading.Thread(target=_prewarm_hf_hub, daemon=True).start()
         self.create_dialog()
         
     def create_dialog(self):
@@ -101,7 +118,8 @@ class PreferencesDialog:
         
         ttk.Button(button_frame, text="Save", command=self._save_api_key).pack(side=tk.RIGHT, padx=5)
         ttk.Button(button_frame, text="Remove Key", command=self._delete_api_key).pack(side=tk.RIGHT, padx=5)
-        ttk.Button(button_frame, text="Test Connection", command=self._test_api_key).pack(side=tk.RIGHT, padx=5)
+        self.test_button = ttk.Button(button_frame, text="Test Connection", command=self._test_api_key)
+        self.test_button.pack(side=tk.RIGHT, padx=5)
     
     def setup_about_tab(self, parent):
         """Setup the About tab content"""
@@ -174,25 +192,44 @@ class PreferencesDialog:
             messagebox.showwarning("Warning", "Please enter an API key first")
             return
             
-        # Display a busy cursor
+        # Display a busy cursor and block repeated clicks while testing
+        self.test_button.config(state=tk.DISABLED)
         self.dialog.config(cursor="watch")
-        self.dialog.update()
         
-        try:
-            import huggingface_hub
-            
+        def do_test():
+            # Network calls happen here, off the Tk main thread
             try:
-                # Temporarily login to test the token
-                huggingface_hub.login(token=api_key)
-                
-                # Check if login worked by trying to get user info
-                user_info = huggingface_hub.whoami()
+                huggingface_hub = _hf_hub()
                 
-                messagebox.showinfo("Success", f"API key is valid! Logged in as: {user_info['name']}")
-            except Exception as e:
-                messagebox.showerror("Error", f"API key validation failed: {str(e)}")
-        except ImportError:
-            messagebox.showerror("Error", "Hugging Face Hub package is not installed")
-        finally:
-            # Restore normal cursor
-            self.dialog.config(cursor="")
+                try:
+                    # Temporarily login to test the token
+                    huggingface_hub.login(token=api_key)
+                    
+                    # Check if login worked by trying to get user info
+                    user_info = huggingface_hub.whoami()
+                    
+                    result = (True, f"API key is valid! Logged in as: {user_info['name']}")
+                except Exception as e:
+                    result = (False, f"API key validation failed: {str(e)}")
+            except ImportError:
+                result = (False, "Hugging Face Hub package is not installed")
+            
+            self.dialog.after(0, lambda: self._show_test_result(result))
+        
+        threading.Thread(target=do_test, daemon=True).start()
+    
+    def _show_test_result(self, result):
+        """Report the API key test outcome (main thread only)"""
+        # The dialog may have been closed while the test was running
+        if not self.dialog.winfo_exists():
+            return
+        
+        # Restore normal cursor
+        self.test_button.config(state=tk.NORMAL)
+        self.dialog.config(cursor="")
+        
+        success, message = result
+        if success:
+            messagebox.showinfo("Success", message)
+        else:
+            messagebox.showerror("Error", message)
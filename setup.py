@@ -1,19 +1,29 @@
+import os
 from setuptools import setup, find_packages
 
+
+def _read_readme():
+    """Return README.md next to this file, or an empty string if it is missing"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "README.md")
+    if not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
 setup(
     name="wawachat",
     version="1.5.0",
     packages=find_packages(),
     install_requires=[
         "torch>=2.0.0",
-        "transformers>=4.30.0",
+        "transformers>=4.42.0",
         "huggingface-hub>=0.16.0",
         "python-dotenv>=0.19.0",
     ],
     author="Wagner Silva Montes",
     author_email="your.email@example.com",
     description="A lightweight chat application powered by TinyLlama",
-    long_description=open("README.md").read(),
+    long_description=_read_readme(),
     long_description_content_type="text/markdown",
     url="https://github.com/yourusername/WawaChat",
     classifiers=[
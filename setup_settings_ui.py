@@ -1,6 +1,15 @@
 import tkinter as tk
 from tkinter import ttk
 
+# Generation parameter rows: (label, settings key, default value, widget type)
+SETTING_SPECS = [
+    ("Max new tokens", "max_new_tokens", 50, "entry"),
+    ("Temperature", "temperature", 0.5, "entry"),
+    ("Top P", "top_p", 0.9, "entry"),
+    ("Truncation", "truncation", "True", "select"),
+    ("Do Sample", "do_sample", "True", "select"),
+]
+
 def setup_settings_ui(self):
     """Set up the settings UI components."""
     # Title label
@@ -22,25 +31,20 @@ def setup_settings_ui(self):
             select.grid(row=row, column=2, pady=2, padx=5, sticky='ew')
             return var
 
-    # Numeric and text parameters
-    row_offset = 1
-    self.settings = {
-        "max_new_tokens": add_setting("Max new tokens", 50, row_offset),
-        "temperature": add_setting("Temperature", 0.5, row_offset + 1),
-        "top_p": add_setting("Top P", 0.9, row_offset + 2),
-        "num_beams": add_setting("Num Beams", 2, row_offset + 3),
-    }
-
-    # Boolean parameters with select dropdowns
-    self.boolean_settings = {
-        "truncation": add_setting("Truncation", "True", row_offset + 4, "select"),
-        "do_sample": add_setting("Do Sample", "True", row_offset + 5, "select"),
-        "early_stopping": add_setting("Early Stopping", "True", row_offset + 6, "select"),
-    }
+    # Numeric and text parameters go in entries, boolean ones in select dropdowns
+    self.settings = {}
+    self.boolean_settings = {}
+    row = 1
+    for label, key, default_value, setting_type in SETTING_SPECS:
+        widget = add_setting(label, default_value, row, setting_type)
+        if setting_type == "entry":
+            self.settings[key] = widget
+        else:
+            self.boolean_settings[key] = widget
+        row += 1
 
     # Checkboxes for including/excluding parameters
     self.include_settings = {}
-    row = row_offset + 7
     ttk.Separator(self.settings_frame, orient='horizontal').grid(
         row=row, column=1, columnspan=2, sticky='ew', pady=10)
     row += 1
@@ -49,14 +53,7 @@ def setup_settings_ui(self):
         row=row, column=1, columnspan=2, pady=(0, 5), sticky='w')
     row += 1
 
-    for key in self.settings.keys():
-        var = tk.BooleanVar(value=True)
-        chk = tk.Checkbutton(self.settings_frame, text=f"Include {key}", var=var)
-        chk.grid(row=row, column=1, columnspan=2, sticky='w')
-        self.include_settings[key] = var
-        row += 1
-
-    for key in self.boolean_settings.keys():
+    for _, key, _, _ in SETTING_SPECS:
         var = tk.BooleanVar(value=True)
         chk = tk.Checkbutton(self.settings_frame, text=f"Include {key}", var=var)
         chk.grid(row=row, column=1, columnspan=2, sticky='w')
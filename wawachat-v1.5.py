@@ -1,16 +1,45 @@
+import os
+
+# Decoding one token at a time gives each op little work, so a few threads beat all cores
+# (OpenMP/MKL read these when torch loads, an explicit setting in the environment wins)
+CPU_THREADS = min(4, (os.cpu_count() or 2) // 2 or 1)
+try:
+    # OpenMP also accepts per-level lists such as "4,2", the first level is torch's pool
+    CPU_THREADS = max(1, int(os.environ["OMP_NUM_THREADS"].split(",")[0]))
+except (KeyError, ValueError):
+    pass
+os.environ.setdefault("OMP_NUM_THREADS", str(CPU_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(CPU_THREADS))
+
+# Keep torch.compile's generated kernels between runs, later starts load them instead of rebuilding
+INDUCTOR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "wawachat", "inductor")
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", INDUCTOR_CACHE_DIR)
+os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
 import torch
+torch.set_num_threads(CPU_THREADS)
+torch.set_num_interop_threads(1)
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-from transformers import pipeline
+from transformers import (AutoModelForCausalLM, AutoTokenizer, DynamicCache,
+                          StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer)
 import threading
-import time
-import os
+import queue
+import itertools
+import importlib.util
+import tempfile
+from collections import deque
+import io
+import platform
+import copy
 import sys
 import json
 
 # Try to import optional dependencies with graceful fallbacks
 try:
     import huggingface_hub
+    from huggingface_hub.utils import tqdm as hf_tqdm
     HUGGINGFACE_AVAILABLE = True
 except ImportError:
     HUGGINGFACE_AVAILABLE = False
@@ -34,9 +63,15 @@ DEFAULT_MODELS = [
     "google/gemma-2b"
 ]
 
+# Optional system prompt put at the start of every conversation
+SYSTEM_PROMPT = os.environ.get("WAWACHAT_SYSTEM_PROMPT", "")
+
 # Configuration file path
 CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
 
+# Exported ONNX models, one directory per model
+ONNX_CACHE_DIR = os.path.join(os.path.dirname(CONFIG_FILE), "onnx")
+
 # Get Hugging Face token from environment variable instead of hardcoding it
 if HUGGINGFACE_AVAILABLE:
     huggingface_token = os.environ.get("HUGGINGFACE_TOKEN")
@@ -46,6 +81,9 @@ if HUGGINGFACE_AVAILABLE:
         print("Warning: HUGGINGFACE_TOKEN not found in environment variables.")
         print("Some models may not be available. Set this in a .env file or as an environment variable.")
 
+# Generation parameter rows shown in the settings panel
+from setup_settings_ui import SETTING_SPECS
+
 # Import the model manager module
 try:
     from model_manager_ui import ModelManagerUI
@@ -54,24 +92,137 @@ except ImportError:
     MODEL_MANAGER_AVAILABLE = False
     print("Warning: Model Manager UI modules not found. Model management features will be disabled.")
 
+class CancelCriteria(StoppingCriteria):
+    """Stop generation as soon as the given event is set"""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(),
+                          dtype=torch.bool, device=input_ids.device)
+
 class WawaChatApplication:
+    # Messages that may wait for a response before new ones are refused
+    MAX_PENDING_MESSAGES = 4
+    
+    # Pending conversation text is written to the widget at most this often (ms)
+    HISTORY_FLUSH_MS = 16
+    
+    # Keys the read-only conversation widget still handles, with or without modifiers:
+    # cursor movement, paging, and the modifier keys themselves (Shift+movement selects)
+    HISTORY_NAVIGATION_KEYS = frozenset({
+        "Left", "Right", "Up", "Down", "Home", "End", "Prior", "Next",
+        "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R",
+        "Meta_L", "Meta_R", "Super_L", "Super_R",
+    })
+    
+    # Keys let through with Control or Command held: copy and select all
+    HISTORY_SHORTCUT_KEYS = frozenset({"c", "C", "a", "A", "Insert", "slash", "backslash"})
+    
+    # Oldest lines are dropped once the conversation widget holds more characters than this
+    MAX_HISTORY_CHARS = 200000
+    
+    # A response still generating after this many seconds is stopped
+    MAX_GENERATION_TIME = 30
+    
+    # Quiet period before a changed config is written to disk (ms)
+    CONFIG_SAVE_DELAY_MS = 1000
+    
+    # Theme colors, built once rather than on every theme change
+    LIGHT_THEME = {
+        "bg_color": "#f0f0f0",
+        "fg_color": "#000000",
+        "text_bg": "#ffffff",
+        "button_bg": "#e0e0e0",
+        "button_fg": "#000000",
+        "user_fg": "#0066cc",
+    }
+    DARK_THEME = {
+        "bg_color": "#2d2d2d",
+        "fg_color": "#ffffff",
+        "text_bg": "#3d3d3d",
+        "button_bg": "#555555",
+        "button_fg": "#ffffff",
+        "user_fg": "#66b3ff",
+    }
+    
     def __init__(self):
         # Load configuration
         self.config = self.load_config()
         
+        # Config snapshot waiting to be written, and the after() id of that write
+        self.pending_config = None
+        self.config_save_pending = None
+        
+        # One config write at a time, so overlapping writes never interleave; snapshots are
+        # numbered so an older one that gets the lock late does not replace a newer one
+        self.config_write_lock = threading.Lock()
+        self.config_version = 0
+        self.written_config_version = 0
+        
         # Create the main window first
         self.window = tk.Tk()
         self.window.title("WawaChat")
         
         # Initialize all variables needed for UI and theme before UI setup
-        self.pipe = None
-        self.model_initialized = threading.Event()
+        self.model = None
+        self.tokenizer = None
+        self.model_ready = False
+        
+        # Why the model could not be loaded, None while loading or once it is ready
+        self.model_error = None
+        
+        # Messages sent while the model is still loading, answered once it is ready
+        self.preload_messages = []
         self.selected_model = tk.StringVar(self.window)
         self.selected_model.set(self.config.get("model", DEFAULT_MODELS[0]))
         self.theme_mode = self.config.get("theme", "light")
-        self.chat_history = []
-        self.download_progress = 0
-        self.download_status = "Idle"
+        self.chat_history = self.new_chat_history()
+        
+        # KV cache kept between turns and the token ids it was built from
+        self.past_key_values = None
+        self.cached_input_ids = None
+        self.generation_lock = threading.Lock()
+        
+        # Rendered prompt texts with their token ids, newest first: the last prompt plus
+        # its response, and the last prompt alone (a prefix even if the response re-renders differently)
+        self.prompt_token_cache = []
+        
+        # Special token strings a prompt may be split after without changing its tokenization
+        self.split_tokens = ()
+        
+        # Chat template reduced to per-role format strings, and the prompt rendered with it so far
+        self.chat_format = None
+        self.generation_prompt = ""
+        self.prompt_buffer = io.StringIO()
+        self.prompt_message_count = 0
+        self.prompt_history = None
+        
+        # KV cache and token ids of the system prompt alone, the start of every conversation
+        self.system_kv = None
+        self.system_ids = None
+        
+        # Token ids that end a response, generation stops at the first one
+        self.stop_token_ids = None
+        self.reuse_kv_cache = True
+        
+        # Set to stop the response currently being streamed
+        self.cancel_event = threading.Event()
+        
+        # Conversation text waiting for the next flush into the Text widget
+        self.pending_chunks = deque()
+        self.flush_scheduled = False
+        self.history_chars = 0
+        
+        # Numbers of the messages still in the widget, each has msg_<n>_start/_end marks
+        self.message_marks = deque()
+        
+        # Hands out message numbers from any thread (next() on it is atomic)
+        self.message_numbers = itertools.count(1)
+        
+        # Latest status bar text waiting to be shown, older pending ones are dropped
+        self.pending_status = None
+        self.status_scheduled = False
         
         # Complete the rest of the UI setup
         self.initialize_ui()
@@ -82,6 +233,10 @@ class WawaChatApplication:
         # Start model initialization
         self.update_status("Initializing model...")
         threading.Thread(target=self.initialize_model, daemon=True).start()
+        
+        # One long-lived worker answers messages in order
+        self.jobs = queue.Queue(maxsize=self.MAX_PENDING_MESSAGES)
+        threading.Thread(target=self.worker_loop, daemon=True).start()
 
     def load_config(self):
         """Load configuration from file or return default config"""
@@ -94,26 +249,62 @@ class WawaChatApplication:
         # Default config
         return {
             "model": DEFAULT_MODELS[0],
-            "theme": "light"
+            "theme": "light",
+            "quantize": False,
+            "backend": "pytorch",
+            "prefer_mps": True,
+            "compile": True
         }
 
     def save_config(self):
-        """Save current configuration to file"""
-        config = {
+        """Save current configuration to file, once changes have stopped for a moment"""
+        # Keep settings the UI does not edit (such as "quantize", "backend", "prefer_mps" and "compile")
+        config = dict(self.config)
+        config.update({
             "model": self.selected_model.get(),
             "theme": self.theme_mode
-        }
-        try:
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(config, f, indent=2)
-        except Exception as e:
-            print(f"Error saving config: {e}")
-            self.update_status(f"Error saving config: {e}")
+        })
+        self.pending_config = config
+        
+        # Several changes in a row (theme toggles, model edits) become a single write
+        if self.config_save_pending is not None:
+            self.window.after_cancel(self.config_save_pending)
+        self.config_save_pending = self.window.after(self.CONFIG_SAVE_DELAY_MS, self.flush_config)
+
+    def flush_config(self):
+        """Write the pending config on a background thread"""
+        self.config_save_pending = None
+        config, self.pending_config = self.pending_config, None
+        if config is not None:
+            self.config_version += 1
+            threading.Thread(target=self.write_config, args=(config, self.config_version), daemon=True).start()
+
+    def write_config(self, config, version=None, report_errors=True):
+        """Write a config snapshot to disk atomically (safe from any thread)"""
+        with self.config_write_lock:
+            if version is not None:
+                if version < self.written_config_version:
+                    return
+                self.written_config_version = version
+            tmp_file = None
+            try:
+                # Swap in a complete temp file of our own so a crash never leaves a half-written config
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(CONFIG_FILE), suffix=".tmp")
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(config, f, indent=2)
+                os.replace(tmp_file, CONFIG_FILE)
+            except Exception as e:
+                print(f"Error saving config: {e}")
+                if tmp_file is not None and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                # The status bar is gone once the main loop has exited
+                if report_errors:
+                    self.update_status(f"Error saving config: {e}")
 
     def on_model_changed(self, *args):
         """Handle model selection change"""
         new_model = self.selected_model.get()
-        if self.pipe is not None and new_model != self.config.get("model"):
+        if (self.model is not None or self.model_error is not None) and new_model != self.config.get("model"):
             self.update_status(f"Model changed to {new_model}. Restart required to apply.")
             # Save the new selection
             self.config["model"] = new_model
@@ -146,6 +337,14 @@ class WawaChatApplication:
         self.window.geometry(f"{window_width}x{window_height}+{center_x}+{center_y}")
         self.window.resizable(True, True)
 
+        # One style object for the app, with a label style per theme registered up front
+        self.style = ttk.Style(self.window)
+        for style_name, theme in (("Light.TLabel", self.LIGHT_THEME), ("Dark.TLabel", self.DARK_THEME)):
+            self.style.configure(style_name, background=theme["bg_color"], foreground=theme["fg_color"])
+        
+        # Widgets by the colors they take, filled in as they are created
+        self.themed_widgets = {"bg": [], "entry": [], "button": [], "check": [], "label": []}
+
         # Create main container frames
         self.main_frame = tk.Frame(self.window)
         self.main_frame.pack(expand=True, fill=tk.BOTH)
@@ -168,18 +367,13 @@ class WawaChatApplication:
     
     def apply_theme(self):
         """Apply the current theme to all widgets"""
-        if self.theme_mode == "dark":
-            bg_color = "#2d2d2d"
-            fg_color = "#ffffff"
-            text_bg = "#3d3d3d"
-            button_bg = "#555555"
-            button_fg = "#ffffff"
-        else:  # light mode
-            bg_color = "#f0f0f0"
-            fg_color = "#000000"
-            text_bg = "#ffffff"
-            button_bg = "#e0e0e0"
-            button_fg = "#000000"
+        theme = self.DARK_THEME if self.theme_mode == "dark" else self.LIGHT_THEME
+        bg_color = theme["bg_color"]
+        fg_color = theme["fg_color"]
+        text_bg = theme["text_bg"]
+        button_bg = theme["button_bg"]
+        button_fg = theme["button_fg"]
+        user_fg = theme["user_fg"]
         
         # Apply to main window and frames
         self.window.config(bg=bg_color)
@@ -189,42 +383,23 @@ class WawaChatApplication:
         
         # Apply to conversation elements
         self.conversation_history.config(bg=text_bg, fg=fg_color)
+        self.conversation_history.tag_configure("user", foreground=user_fg)
         self.new_message_input.config(bg=text_bg, fg=fg_color)
         
-        # Special handling for ttk widgets
-        # For ttk widgets, we need to use a style
-        style = ttk.Style()
-        
-        # Configure the ttk.Label style
-        style.configure('TLabel', background=bg_color, foreground=fg_color)
+        # ttk labels switch to the prebuilt style of the theme, no style is reconfigured
+        label_style = "Dark.TLabel" if self.theme_mode == "dark" else "Light.TLabel"
+        for widget in self.themed_widgets["label"]:
+            widget.configure(style=label_style)
         
-        # Apply to status bar (ttk.Label)
-        self.status_bar.configure(style='TLabel')
-        
-        # Update settings widgets if they exist
-        for widget in self.settings_frame.winfo_children():
-            try:
-                if isinstance(widget, tk.Label):
-                    # Regular tk.Label supports bg color and fg color
-                    widget.config(bg=bg_color, fg=fg_color)
-                elif isinstance(widget, ttk.Label):
-                    # ttk.Label styling is handled by the style above
-                    pass
-                elif isinstance(widget, tk.Entry):
-                    # Regular tk.Entry supports bg color and fg color
-                    widget.config(bg=text_bg, fg=fg_color)
-                elif isinstance(widget, ttk.Entry):
-                    # Can't directly style ttk.Entry this way
-                    pass
-                elif isinstance(widget, tk.Button):
-                    widget.config(bg=button_bg, fg=button_fg)
-                elif isinstance(widget, tk.Checkbutton):
-                    widget.config(bg=bg_color, fg=fg_color, selectcolor=button_bg)
-                elif isinstance(widget, tk.Frame):
-                    widget.config(bg=bg_color)
-            except tk.TclError:
-                # Skip widgets that don't support the attempted configuration
-                pass
+        # Settings widgets were grouped by role when created, so no type checks here
+        for widget in self.themed_widgets["bg"]:
+            widget.config(bg=bg_color)
+        for widget in self.themed_widgets["entry"]:
+            widget.config(bg=text_bg, fg=fg_color)
+        for widget in self.themed_widgets["button"]:
+            widget.config(bg=button_bg, fg=button_fg)
+        for widget in self.themed_widgets["check"]:
+            widget.config(bg=bg_color, fg=fg_color, selectcolor=button_bg)
     
     def toggle_theme(self):
         """Toggle between light and dark themes"""
@@ -242,7 +417,12 @@ class WawaChatApplication:
 
         self.conversation_history = tk.Text(conversation_frame, height=20, width=50)
         self.conversation_history.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.conversation_history.config(state=tk.DISABLED)
+        
+        # The widget stays editable for our inserts; user edits are swallowed instead
+        # (copy shortcuts and selection keep working)
+        self.conversation_history.bind("<Key>", self.block_history_edit)
+        for sequence in ("<<Cut>>", "<<Paste>>", "<<PasteSelection>>", "<<Clear>>"):
+            self.conversation_history.bind(sequence, lambda e: "break")
 
         # Scrollbar
         conversation_scrollbar = tk.Scrollbar(conversation_frame)
@@ -257,29 +437,37 @@ class WawaChatApplication:
         self.new_message_input = tk.Entry(input_frame, width=50)
         self.new_message_input.pack(side=tk.LEFT, fill=tk.X, padx=(0, 5), pady=5, expand=True)
         self.new_message_input.bind("<Return>", self.send_message)
+        self.new_message_input.bind("<Escape>", self.stop_generation)
 
         # Status bar
         self.status_bar = ttk.Label(self.chat_frame, text="Loading...", relief=tk.SUNKEN, anchor="w")
         self.status_bar.pack(fill=tk.X, side=tk.BOTTOM, ipady=2, padx=2)
+        self.themed_widgets["label"].append(self.status_bar)
 
     def setup_settings_ui(self):
         def add_setting(setting_name, default_value, row, setting_type="entry"):
-            ttk.Label(self.settings_frame, text=setting_name).grid(row=row, column=1, sticky='w', pady=2)
+            label = ttk.Label(self.settings_frame, text=setting_name)
+            label.grid(row=row, column=1, sticky='w', pady=2)
+            self.themed_widgets["label"].append(label)
 
+            # Every edit rebuilds the cached generation parameters
+            var = tk.StringVar(self.settings_frame, value=str(default_value))
+            var.trace_add("write", self.refresh_generation_parameters)
+            
             if setting_type == "entry":
-                entry = tk.Entry(self.settings_frame)
-                entry.insert(0, str(default_value))
+                entry = tk.Entry(self.settings_frame, textvariable=var)
                 entry.grid(row=row, column=2, pady=2)
+                self.themed_widgets["entry"].append(entry)
                 return entry
             elif setting_type == "select":
-                var = tk.StringVar(self.settings_frame)
-                var.set(str(default_value))
                 select = ttk.Combobox(self.settings_frame, textvariable=var, values=("True", "False"))
                 select.grid(row=row, column=2, pady=2)
                 return var
 
         # Model selection dropdown
-        ttk.Label(self.settings_frame, text="Model:").grid(row=0, column=1, sticky='w', pady=2)
+        model_label = ttk.Label(self.settings_frame, text="Model:")
+        model_label.grid(row=0, column=1, sticky='w', pady=2)
+        self.themed_widgets["label"].append(model_label)
         model_dropdown = ttk.Combobox(self.settings_frame, textvariable=self.selected_model, values=DEFAULT_MODELS)
         model_dropdown.grid(row=0, column=2, pady=2, sticky='ew')
         
@@ -291,37 +479,31 @@ class WawaChatApplication:
         ttk.Separator(self.settings_frame, orient='horizontal').grid(
             row=1, column=1, columnspan=2, sticky='ew', pady=5)
 
-        # Numeric and text parameters - starting from row 2 now
-        self.settings = {
-            "max_new_tokens": add_setting("Max new tokens", 50, 2),
-            "temperature": add_setting("Temperature", 0.5, 3),
-            "top_p": add_setting("Top P", 0.9, 4),
-            "num_beams": add_setting("Num Beams", 2, 5),
-        }
-
-        # Boolean parameters with select dropdowns
-        self.boolean_settings = {
-            "truncation": add_setting("Truncation", "True", 6, "select"),
-            "do_sample": add_setting("Do Sample", "True", 7, "select"),
-            "early_stopping": add_setting("Early Stopping", "True", 8, "select"),
-        }
+        # Numeric and text parameters go in entries, boolean ones in select dropdowns (from row 2)
+        self.settings = {}
+        self.boolean_settings = {}
+        row = 2
+        for label, key, default_value, setting_type in SETTING_SPECS:
+            widget = add_setting(label, default_value, row, setting_type)
+            if setting_type == "entry":
+                self.settings[key] = widget
+            else:
+                self.boolean_settings[key] = widget
+            row += 1
 
         # Checkboxes for including/excluding parameters
         self.include_settings = {}
-        row = 9
-        for key in self.settings.keys():
-            var = tk.BooleanVar(value=True)
-            chk = tk.Checkbutton(self.settings_frame, text=f"Include {key}", var=var)
-            chk.grid(row=row, column=1, columnspan=2, sticky='w')
-            self.include_settings[key] = var
-            row += 1
-
-        for key in self.boolean_settings.keys():
+        for _, key, _, _ in SETTING_SPECS:
             var = tk.BooleanVar(value=True)
+            var.trace_add("write", self.refresh_generation_parameters)
             chk = tk.Checkbutton(self.settings_frame, text=f"Include {key}", var=var)
             chk.grid(row=row, column=1, columnspan=2, sticky='w')
+            self.themed_widgets["check"].append(chk)
             self.include_settings[key] = var
             row += 1
+        
+        # Build the generation parameters once from the initial values
+        self.refresh_generation_parameters()
 
         # Add a separator before buttons
         row += 1
@@ -332,6 +514,7 @@ class WawaChatApplication:
         # Button frame for controls
         button_frame = tk.Frame(self.settings_frame)
         button_frame.grid(row=row, column=1, columnspan=2, sticky='ew', pady=5)
+        self.themed_widgets["bg"].append(button_frame)
         row += 1
 
         # Clear button
@@ -347,69 +530,199 @@ class WawaChatApplication:
             model_mgr_btn = tk.Button(self.settings_frame, text="Manage Model Cache", 
                                     command=self.open_model_manager)
             model_mgr_btn.grid(row=row, column=1, columnspan=2, sticky='ew', pady=5)
+            self.themed_widgets["button"].append(model_mgr_btn)
+            row += 1
 
     def initialize_model(self):
         """Initialize the model with Mac-optimized settings"""
         try:
             self.update_status("Downloading model (this may take a while)...")
             
-            # Create a progress tracker using a separate thread
-            progress_thread = threading.Thread(target=self.track_download_progress, daemon=True)
-            progress_thread.start()
-            
             try:
-                # Initialize the pipeline with the selected model
+                # Initialize the model with the selected model
                 model_name = self.selected_model.get()
                 
-                # Mac-optimized model settings - FIXED: removed duplicate torch_dtype
-                self.pipe = pipeline(
-                    "text-generation", 
-                    model=model_name, 
-                    torch_dtype=torch.float32,  # float32 is more stable on Mac CPUs
-                    device_map="cpu",  # Force CPU usage for maximum stability on Mac
-                    model_kwargs={
-                        "low_cpu_mem_usage": True,
-                        "use_cache": True,
-                        "offload_folder": None,  # Avoid disk offloading which can be slow on Mac
-                        # Removed duplicate torch_dtype parameter that was causing the error
-                    }
-                )
+                # Load the tokenizer and model directly (not through pipeline) so the
+                # KV cache can be carried from one turn to the next
+                load_kwargs = {
+                    "torch_dtype": torch.float32,  # float32 is more stable on Mac CPUs
+                    "device_map": "cpu",  # Force CPU usage for maximum stability on Mac
+                    "low_cpu_mem_usage": True,
+                    "use_cache": True,
+                    "offload_folder": None,  # Avoid disk offloading which can be slow on Mac
+                }
+                
+                # Apple Silicon GPU: much more memory bandwidth than the CPU, float16 is its fast path.
+                # Intel Macs (and "prefer_mps": false) keep the CPU settings above
+                if (self.config.get("prefer_mps", True) and platform.machine() == "arm64"
+                        and torch.backends.mps.is_available()):
+                    load_kwargs.update(torch_dtype=torch.float16, device_map={"": "mps"})
+                
+                # 4-bit weights move a quarter of the bytes per decoded token;
+                # bitsandbytes only runs on CUDA, so it is only imported there (never on a Mac)
+                elif torch.cuda.is_available():
+                    try:
+                        # Probe up front: a missing package would otherwise only fail inside
+                        # from_pretrained, outside this fallback, and abort the whole load
+                        if importlib.util.find_spec("bitsandbytes") is None:
+                            raise ImportError("bitsandbytes is not installed")
+                        from transformers import BitsAndBytesConfig
+                        load_kwargs.update(
+                            torch_dtype=torch.float16,
+                            device_map="auto",
+                            quantization_config=BitsAndBytesConfig(
+                                load_in_4bit=True,
+                                bnb_4bit_compute_dtype=torch.float16,
+                                bnb_4bit_quant_type="nf4",
+                            ),
+                        )
+                    except Exception as e:
+                        # Missing, or installed without working CUDA binaries
+                        print(f"bitsandbytes unavailable, loading without 4-bit quantization: {e}")
+                
+                # Fetch the files in parallel first, from_pretrained then loads from the local cache
+                self.prefetch_model(model_name)
+                self.update_status(f"Loading model {model_name}...")
+                
+                # The Rust-backed fast tokenizer, never the slow Python fallback
+                self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+                if self.tokenizer.pad_token_id is None:
+                    # generate() would otherwise warn and pick a pad token on every call
+                    self.tokenizer.pad_token = self.tokenizer.eos_token
+                self.model = None
+                if self.config.get("backend") == "onnx":
+                    self.model = self.load_onnx_model(model_name)
+                if self.model is None:
+                    try:
+                        # PyTorch's fused scaled-dot-product attention kernel
+                        self.model = AutoModelForCausalLM.from_pretrained(
+                            model_name, attn_implementation="sdpa", **load_kwargs
+                        )
+                    except ValueError as e:
+                        # Architectures without SDPA support keep their stock attention
+                        print(f"SDPA attention not supported, using default attention: {e}")
+                        self.model = AutoModelForCausalLM.from_pretrained(model_name, **load_kwargs)
+                
+                # Cross-turn KV cache reuse and the tweaks below need a PyTorch model
+                self.reuse_kv_cache = isinstance(self.model, torch.nn.Module)
+                
+                # Optional int8 Linear weights on the CPU path: half the bytes per token and int8 GEMMs
+                quantized = False
+                if (self.config.get("quantize", False) and self.reuse_kv_cache
+                        and self.model.device.type == "cpu"):
+                    try:
+                        self.model = torch.ao.quantization.quantize_dynamic(
+                            self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                        )
+                        quantized = True
+                        print("Model quantized to int8")
+                    except Exception as e:
+                        print(f"Int8 quantization failed, using float32: {e}")
+                
+                self.compile_chat_format()
+                self.stop_token_ids = self.get_stop_token_ids()
+                self.split_tokens = self.get_split_tokens()
+                
+                # Fuse the many small per-token ops (MPS and CPU); generate() calls forward, so compile that.
+                # Int8 dynamic-quantized layers are left eager, and "compile": false turns this off
+                eager_forward = self.model.forward
+                compiled = False
+                if (self.config.get("compile", True) and self.reuse_kv_cache and not quantized
+                        and self.model.device.type in ("mps", "cpu") and hasattr(torch, "compile")):
+                    try:
+                        self.model.forward = torch.compile(eager_forward, dynamic=True)
+                        compiled = True
+                    except Exception as e:
+                        print(f"torch.compile unavailable, using eager mode: {e}")
                 
                 # Perform a warmup inference for faster subsequent generation
-                self.warmup_model()
+                # (this is also where compilation happens, and where it fails if it does);
+                # dynamic=True makes the prompt length symbolic, so one run builds the kernels for all lengths
+                if not self.warmup_model() and compiled:
+                    print("Compiled model failed to run, falling back to eager mode")
+                    self.model.forward = eager_forward
+                    self.warmup_model()
+                
+                # Prefill the system prompt once, every conversation starts from its cache
+                self.prefill_system_prompt()
+                self.reset_kv_cache()
                 
-                # Stop the progress tracking
-                self.download_status = "Complete"
-                self.model_initialized.set()
                 self.update_status(f"Model {model_name} ready.")
+                self.window.after(0, self.on_model_ready)
             except Exception as e:
-                self.download_status = "Error"
                 self.update_status(f"Error initializing model: {str(e)}")
                 print(f"Model initialization error: {str(e)}")
+                self.window.after(0, self.on_model_failed, str(e))
         except Exception as e:
-            self.download_status = "Error"
             self.update_status(f"Error in model initialization: {str(e)}")
             print(f"Critical error in model thread: {str(e)}")
+            self.window.after(0, self.on_model_failed, str(e))
 
-    def warmup_model(self):
+    def prefetch_model(self, model_name):
+        """Download the model's weight shards and config files with parallel workers"""
+        if not HUGGINGFACE_AVAILABLE:
+            return
+        
+        app = self
+        
+        class StatusProgress(hf_tqdm):
+            """Progress bar that reports finished files in the status bar instead of polling"""
+            def update(self, n=1):
+                result = super().update(n)
+                if self.total:
+                    app.update_status(f"Downloading model files {self.n}/{self.total}...")
+                return result
+        
+        try:
+            # Only what from_pretrained needs; anything else it finds missing it downloads itself
+            huggingface_hub.snapshot_download(
+                repo_id=model_name,
+                allow_patterns=["*.json", "*.safetensors", "*.model", "*.txt"],
+                max_workers=8,
+                etag_timeout=30,
+                tqdm_class=StatusProgress,
+            )
+        except Exception as e:
+            print(f"Model prefetch failed, loading will download as needed: {e}")
+    
+    def load_onnx_model(self, model_name):
+        """Load the ONNX Runtime export of a model, exporting it on first use"""
+        onnx_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "--"))
+        try:
+            # Imported only when this backend is chosen, optimum and onnxruntime are slow to load
+            from optimum.onnxruntime import ORTModelForCausalLM
+            
+            # ONNX Runtime applies its full graph optimizations (node fusion) when the session is created
+            if os.path.isdir(onnx_dir):
+                return ORTModelForCausalLM.from_pretrained(onnx_dir, provider="CPUExecutionProvider")
+            
+            self.update_status("Exporting model to ONNX (first run only)...")
+            model = ORTModelForCausalLM.from_pretrained(
+                model_name, export=True, provider="CPUExecutionProvider"
+            )
+            model.save_pretrained(onnx_dir)
+            return model
+        except Exception as e:
+            print(f"ONNX Runtime backend unavailable, using PyTorch: {e}")
+            return None
+    
+    def warmup_model(self, prompt_length=8):
         """Perform a quick inference to initialize the model's caches"""
         try:
             # Simple warmup to prime internal caches and compile any operations
-            _ = self.pipe("Hello", max_new_tokens=5, do_sample=False, num_beams=1)
+            token_id = self.tokenizer.bos_token_id
+            if token_id is None:
+                token_id = self.tokenizer("Hello", add_special_tokens=False).input_ids[0]
+            input_ids = torch.full((1, prompt_length), token_id, dtype=torch.long, device=self.model.device)
+            with torch.inference_mode():
+                # Two new tokens are the fewest that run both a prefill and a single-token decode step
+                _ = self.model.generate(input_ids, attention_mask=torch.ones_like(input_ids),
+                                        max_new_tokens=2, do_sample=False, num_beams=1)
             print("Model warmup completed")
+            return True
         except Exception as e:
             print(f"Model warmup failed: {e}")
-
-    def track_download_progress(self):
-        """Track and display model download progress"""
-        self.download_status = "Downloading"
-        progress_chars = ["|", "/", "-", "\\"]
-        i = 0
-        
-        while self.download_status == "Downloading":
-            self.update_status(f"Downloading model {progress_chars[i]} (this may take a while)")
-            i = (i + 1) % len(progress_chars)
-            time.sleep(0.5)
+            return False
 
     def open_model_manager(self):
         """Open the model manager window"""
@@ -424,123 +737,479 @@ class WawaChatApplication:
             if not new_message.strip():
                 return
 
+            # Hand the message and the current settings to the worker, so it never reads Tk state;
+            # keep the message in the input box if the worker is backed up
+            if self.model_error is not None:
+                # Nothing will ever answer, keep the message in the input box
+                self.update_status(f"Model failed to load ({self.model_error}). "
+                                   "Select another model and restart.")
+                return
+            if not self.model_ready:
+                # Nothing is being generated yet, so the message can be shown right away
+                self.preload_messages.append((new_message, self.get_generation_parameters(), True))
+                self.echo_user_message(new_message)
+                status = "Model is still loading, your message will be answered when it is ready."
+            else:
+                # The worker shows the message when it takes it, never inside a streaming response
+                try:
+                    self.jobs.put_nowait((new_message, self.get_generation_parameters(), False))
+                except queue.Full:
+                    self.update_status("Still working on earlier messages, please wait...")
+                    return
+                status = "Generating response..."
+
             self.new_message_input.delete(0, tk.END)
-            self.update_conversation_history("You: " + new_message + "\n")
+            self.update_status(status)
+
+    def echo_user_message(self, message):
+        """Show a user message in the conversation (any thread)"""
+        number = self.mark_conversation_message("start")
+        self.update_conversation_history("You: ", "user")
+        self.update_conversation_history(message, "user")
+        self.update_conversation_history("\n", "user")
+        self.mark_conversation_message("end", number)
+
+    def on_model_failed(self, error):
+        """Stop accepting messages after the model failed to load (main thread only)"""
+        self.model_error = error
+        
+        # Messages typed during loading will not be answered
+        if self.preload_messages:
+            self.preload_messages = []
+            self.update_status(f"Model failed to load ({error}), earlier messages will not be answered. "
+                               "Select another model and restart.")
+
+    def on_model_ready(self):
+        """Start answering messages once the model is loaded (main thread only)"""
+        self.model_ready = True
+        
+        # Messages typed during loading go to the worker as one turn
+        if self.preload_messages:
+            input_text = "\n".join(text for text, _, _ in self.preload_messages)
+            self.jobs.put_nowait((input_text, self.preload_messages[-1][1], True))
+            self.preload_messages = []
             self.update_status("Generating response...")
-            threading.Thread(target=self.generate_and_display_response, args=(new_message,)).start()
-
-    def update_conversation_history(self, message):
-        def append_message():
-            self.conversation_history.config(state=tk.NORMAL)
-            self.conversation_history.insert(tk.END, message)
-            self.conversation_history.config(state=tk.DISABLED)
-            # Automatically scroll to the end to show the latest message
-            self.conversation_history.yview(tk.END)
 
-        # Schedule the update to be run in the main thread
-        self.window.after(0, append_message)
+    def worker_loop(self):
+        """Answer queued messages one at a time for the lifetime of the app"""
+        while True:
+            jobs = [self.jobs.get()]
+            
+            # Messages sent while the last response was generating are answered in one turn,
+            # sharing a single prefill and decode instead of one generation each
+            while True:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            input_text = "\n".join(text for text, _, _ in jobs)
+            
+            # Show the messages not shown yet, the previous response has finished streaming by now
+            for text, _, echoed in jobs:
+                if not echoed:
+                    self.echo_user_message(text)
+            
+            # The settings in effect when the latest message was sent apply
+            generation_parameters = jobs[-1][1]
+            
+            self.process_response(input_text, generation_parameters)
+
+    def block_history_edit(self, event):
+        """Keep the conversation read-only: only navigation, copy and select-all keys get through"""
+        if event.keysym in self.HISTORY_NAVIGATION_KEYS:
+            return None
+        # Control, or Mod1 (Command on macOS)
+        if event.state & (0x4 | 0x8) and event.keysym in self.HISTORY_SHORTCUT_KEYS:
+            return None
+        return "break"
 
+    def update_conversation_history(self, message, tag="ai"):
+        self.pending_chunks.append((message, tag))
+        
+        # Schedule one flush in the main thread for everything queued until then
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.window.after(self.HISTORY_FLUSH_MS, self.flush_conversation_history)
 
-    def generate_and_display_response(self, input_text):
-        self.update_status("Generating response...")
-        self.new_message_input.delete(0, tk.END)
-        self.update_conversation_history("You: " + input_text + "\n")
+    def mark_conversation_message(self, edge, number=None):
+        """Queue a "start" mark for a new message (returns its number) or the "end" mark of message number"""
+        if edge == "start":
+            number = next(self.message_numbers)
+        
+        # Kept in order with the text, a None text tells the flush to set a mark
+        self.pending_chunks.append((None, (edge, number)))
+        return number
 
-        if not self.model_initialized.is_set():
-            print("Model is not yet initialized. Please wait...")
+    def flush_conversation_history(self):
+        """Write all pending text to the conversation widget in one insert (main thread only)"""
+        self.flush_scheduled = False
+        if not self.pending_chunks:
             return
+        
+        # Only follow new text if the user has not scrolled up
+        at_bottom = self.conversation_history.yview()[1] > 0.98
+        
+        # Pass every chunk as its own text/tag pair to a single insert, no joined copy is built;
+        # the insert is only split where a message mark has to go
+        args = []
+        while self.pending_chunks:
+            text, tag = self.pending_chunks.popleft()
+            if text is not None:
+                args.extend((text, tag))
+                continue
+            if args:
+                self.insert_conversation_text(args)
+                args = []
+            self.set_message_mark(*tag)
+        if args:
+            self.insert_conversation_text(args)
+        
+        # Keep the widget bounded by dropping the older half of the conversation
+        if self.history_chars > self.MAX_HISTORY_CHARS:
+            last_line = int(self.conversation_history.index("end-1c").split(".")[0])
+            self.conversation_history.delete("1.0", f"{last_line // 2 + 1}.0")
+            
+            # Count what is left in Tk rather than copying the text out
+            counted = self.conversation_history.count("1.0", "end-1c", "chars")
+            self.history_chars = counted[0] if counted else 0
+            
+            # Forget messages that were deleted completely, which is when the next message now starts
+            # the text (start marks are always set, an end mark may not be if generation failed)
+            while len(self.message_marks) > 1 and self.conversation_history.compare(
+                    f"msg_{self.message_marks[1]}_start", "==", "1.0"):
+                number = self.message_marks.popleft()
+                self.conversation_history.mark_unset(f"msg_{number}_start", f"msg_{number}_end")
+        
+        if at_bottom:
+            self.conversation_history.yview(tk.END)
+
 
-        # Add user message to chat history
-        self.chat_history.append({"role": "user", "content": input_text})
+    def insert_conversation_text(self, args):
+        """Append text/tag pairs to the conversation widget (main thread only)"""
+        self.conversation_history.insert(tk.END, *args)
+        self.history_chars += sum(len(text) for text in args[::2])
 
-        # Offload the response generation to a background thread
-        threading.Thread(target=self.process_response, daemon=True).start()
+    def set_message_mark(self, edge, number):
+        """Set the start or end mark of message number at the end of the text (main thread only)"""
+        if edge == "start":
+            self.message_marks.append(number)
+        elif number not in self.message_marks:
+            # The message was cleared or trimmed away while it was still being written
+            return
+        name = f"msg_{number}_{edge}"
+        self.conversation_history.mark_set(name, "end-1c")
+        # Left gravity keeps the mark where it is when text is appended right at it
+        self.conversation_history.mark_gravity(name, tk.LEFT)
 
-    def process_response(self):
+    def process_response(self, input_text, generation_parameters):
         try:
-            # Get the message that needs a response
-            self.update_ui_with_status("Generating response...")
-            
-            # Set a timeout for the generation
-            MAX_GENERATION_TIME = 30  # seconds
-            
-            # Retrieve UI settings in the main thread context
-            generation_parameters = self.get_generation_parameters()
+            # Add user message to chat history (Clear may swap in a new list meanwhile)
+            chat_history = self.chat_history
+            chat_history.append({"role": "user", "content": input_text})
             
-            # Use the tokenizer's chat template method to format the input text
-            formatted_chat = self.pipe.tokenizer.apply_chat_template(
-                self.chat_history, tokenize=False, add_generation_prompt=True
-            )
+            self.update_ui_with_status("Generating response...")
             
-            # Check if formatted_chat is a string
-            if not isinstance(formatted_chat, str):
-                raise TypeError("The chat history formatting did not return a string.")
+            # Truncation applies to the prompt, generate() does not accept it
+            truncation = generation_parameters.pop("truncation", False)
             
-            # Create a timer to update the UI during generation
-            generation_start = time.time()
+            # Format the conversation with the model's chat template
+            prompt_text = self.render_prompt(chat_history)
+            input_ids = self.tokenize_prompt(prompt_text, truncation)
             
-            def update_generation_status():
-                elapsed = time.time() - generation_start
-                if elapsed < MAX_GENERATION_TIME:
-                    self.update_ui_with_status(f"Generating response... ({int(elapsed)}s)")
-                    self.window.after(500, update_generation_status)
+            with self.generation_lock:
+                self.cancel_event.clear()
+                
+                # Reuse the cached keys/values of the previous turns, only the new tokens are prefilled
+                past_key_values = None
+                if self.reuse_kv_cache:
+                    # Cached tensors come from inference mode, crop them in it as well
+                    with torch.inference_mode():
+                        past_key_values = self.get_reusable_cache(input_ids)
+                
+                # Decoded text arrives here while generate() runs on its own thread
+                streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+                result = {}
+                
+                def generate():
+                    try:
+                        with torch.inference_mode():
+                            result["output_ids"] = self.model.generate(
+                                input_ids,
+                                # A single unpadded prompt, so no padding search is needed
+                                attention_mask=torch.ones_like(input_ids),
+                                pad_token_id=self.tokenizer.pad_token_id,
+                                past_key_values=past_key_values,
+                                streamer=streamer,
+                                stopping_criteria=StoppingCriteriaList([CancelCriteria(self.cancel_event)]),
+                                eos_token_id=self.stop_token_ids,
+                                # Greedy or sampled decoding only, beams would copy the cache per beam
+                                num_beams=1,
+                                **generation_parameters
+                            )
+                    except Exception as e:
+                        result["error"] = e
+                        # generate() did not finish the stream, unblock the reader
+                        streamer.end()
+                
+                generate_thread = threading.Thread(target=generate, daemon=True)
+                generate_thread.start()
+                
+                # Streamed tokens show progress, a single watchdog stops a runaway generation
+                timed_out = threading.Event()
+                
+                def stop_slow_generation():
+                    timed_out.set()
+                    self.stop_generation()
+                
+                watchdog = threading.Timer(self.MAX_GENERATION_TIME, stop_slow_generation)
+                watchdog.daemon = True
+                watchdog.start()
+                
+                # Show the response as it is produced
+                message_number = self.mark_conversation_message("start")
+                self.update_conversation_history("AI: ")
+                chunks = []
+                for chunk in streamer:
+                    chunks.append(chunk)
+                    self.update_conversation_history(chunk)
+                    if self.cancel_event.is_set():
+                        break
+                generate_thread.join()
+                watchdog.cancel()
+                
+                if "error" in result:
+                    raise result["error"]
+                output_ids = result["output_ids"]
+                
+                # Keep the cache for the next turn (backends without a reusable cache drop it)
+                if past_key_values is not None:
+                    self.past_key_values = past_key_values
+                    self.cached_input_ids = output_ids[0]
                 else:
-                    self.update_ui_with_status("Generation is taking longer than expected...")
-            
-            # Start the timer
-            self.window.after(500, update_generation_status)
-            
-            # Run the model pipeline and get the response
-            response = self.pipe(
-                formatted_chat, 
-                batch_size=1,  # Process one token at a time to reduce memory usage
-                num_workers=1,  # Limit worker threads for Mac stability
-                **generation_parameters
-            )
-            
-            # Process the response
-            response_text = response[0]['generated_text']
+                    self.reset_kv_cache()
+                
+                # The next prompt normally starts with this one plus the response
+                # (end-of-turn token included), so its tokens can be reused
+                generated_text = self.tokenizer.decode(
+                    output_ids[0, input_ids.shape[-1]:], clean_up_tokenization_spaces=False
+                )
+                self.prompt_token_cache.insert(0, (prompt_text + generated_text, output_ids[0]))
             
             # Add AI response to chat history
-            ai_response = self.trim_response(response_text)
-            self.chat_history.append({"role": "assistant", "content": ai_response})
+            ai_response = self.trim_response("".join(chunks))
+            chat_history.append({"role": "assistant", "content": ai_response})
             
-            # Update the UI with the response
-            self.update_ui_with_response(ai_response)
+            # Finish the response line in the UI
+            self.update_conversation_history("\n")
+            self.mark_conversation_message("end", message_number)
+            if timed_out.is_set():
+                self.update_ui_with_status(f"Response stopped after {self.MAX_GENERATION_TIME}s. Model ready.")
+            else:
+                self.update_ui_with_status("Model ready.")
         except Exception as e:
+            # A failed generation may have left the cache half-filled
+            self.reset_kv_cache()
             self.update_ui_with_status(f"Error: {str(e)}")
             print(f"Response generation error: {e}")
 
-    def update_ui_with_response(self, response_text):
-        """ Update the conversation history with the AI's response """
-        def update():
-            self.conversation_history.config(state=tk.NORMAL)
-            self.conversation_history.insert(tk.END, "AI: " + response_text + "\n")
-            self.conversation_history.config(state=tk.DISABLED)
-            self.conversation_history.yview(tk.END)
-            self.status_bar.config(text="Model ready.")
+    def get_stop_token_ids(self):
+        """Collect the end-of-sequence and end-of-turn token ids known to the tokenizer"""
+        stop_ids = [self.tokenizer.eos_token_id]
+        for token in ("</s>", "<|user|>", "<|im_end|>", "<|end|>", "<|eot_id|>", "<end_of_turn>"):
+            # Tokens the vocabulary does not have come back as None or the unknown token
+            token_id = self.tokenizer.convert_tokens_to_ids(token)
+            if token_id is not None and token_id != self.tokenizer.unk_token_id:
+                stop_ids.append(token_id)
+        return list(dict.fromkeys(token_id for token_id in stop_ids if token_id is not None)) or None
+    
+    def get_split_tokens(self):
+        """Return the special token strings after which text can be tokenized on its own, if any"""
+        tokens = tuple(dict.fromkeys(list(self.tokenizer.all_special_tokens)
+                                     + list(self.tokenizer.get_added_vocab())))
+        eos_token = self.tokenizer.eos_token
+        if not eos_token:
+            return ()
+        
+        # Some tokenizers (SentencePiece without legacy mode) treat text right after a special
+        # token differently from text at the start, then every split would change the ids
+        eos_ids = self.tokenizer(eos_token, add_special_tokens=False).input_ids
+        for text in ("\n<|user|>\n", "<|im_start|>user\n", "Hello", " Hello"):
+            whole = self.tokenizer(eos_token + text, add_special_tokens=False).input_ids
+            split = eos_ids + self.tokenizer(text, add_special_tokens=False).input_ids
+            if whole != split:
+                return ()
+        return tokens
+    
+    def compile_chat_format(self):
+        """Reduce the chat template to plain format strings when it renders each message on its own"""
+        self.chat_format = None
+        self.generation_prompt = ""
+        self.prompt_buffer = io.StringIO()
+        self.prompt_message_count = 0
+        
+        def render(messages, add_generation_prompt=False):
+            return self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=add_generation_prompt
+            )
+        
+        try:
+            # Render a marker in each role's position and split the output around it
+            marker = "\ue000"
+            question = {"role": "user", "content": "Hi"}
+            user = render([{"role": "user", "content": marker}])
+            asked = render([question])
+            answered = render([question, {"role": "assistant", "content": marker}])
+            if not answered.startswith(asked):
+                return
+            chat_format = {
+                "user": tuple(user.split(marker)),
+                "assistant": tuple(answered[len(asked):].split(marker)),
+            }
+            if SYSTEM_PROMPT:
+                chat_format["system"] = tuple(render([{"role": "system", "content": marker}]).split(marker))
+            generation_prompt = render([question], add_generation_prompt=True)[len(asked):]
+            if any(len(parts) != 2 for parts in chat_format.values()):
+                return
+            
+            # Only use the format strings if they reproduce the template exactly
+            sample = self.new_chat_history() + [
+                {"role": "user", "content": " Hello there "},
+                {"role": "assistant", "content": " Hi! "},
+                {"role": "user", "content": "How are you?"},
+            ]
+            built = "".join(chat_format[m["role"]][0] + m["content"] + chat_format[m["role"]][1] for m in sample)
+            if built + generation_prompt == render(sample, add_generation_prompt=True):
+                self.chat_format = chat_format
+                self.generation_prompt = generation_prompt
+        except Exception as e:
+            print(f"Chat template is rendered in full each turn: {e}")
+    
+    def render_prompt(self, history):
+        """Format the chat history as a prompt, only formatting messages added since the last call"""
+        # A cleared conversation is a new list, start formatting it from scratch
+        if history is not self.prompt_history:
+            self.prompt_buffer = io.StringIO()
+            self.prompt_message_count = 0
+            self.prompt_history = history
+        
+        if self.chat_format is None or any(m["role"] not in self.chat_format
+                                           for m in history[self.prompt_message_count:]):
+            return self.tokenizer.apply_chat_template(history, tokenize=False, add_generation_prompt=True)
+        
+        for message in history[self.prompt_message_count:]:
+            prefix, suffix = self.chat_format[message["role"]]
+            self.prompt_buffer.write(prefix)
+            self.prompt_buffer.write(message["content"])
+            self.prompt_buffer.write(suffix)
+        self.prompt_message_count = len(history)
+        return self.prompt_buffer.getvalue() + self.generation_prompt
+    
+    def tokenize_prompt(self, prompt_text, truncation=False):
+        """Tokenize a rendered prompt, only tokenizing what was added since the last turn"""
+        for cached_text, cached_ids in self.prompt_token_cache:
+            # Only split right after a special token: anywhere else (e.g. a response cut off by
+            # max_new_tokens) the new text can tokenize differently on its own, such as a leading "▁"
+            if prompt_text.startswith(cached_text) and cached_text.endswith(self.split_tokens):
+                suffix_ids = self.tokenizer(
+                    prompt_text[len(cached_text):], add_special_tokens=False, return_tensors="pt"
+                ).input_ids.to(self.model.device)
+                input_ids = torch.cat([cached_ids.unsqueeze(0), suffix_ids], dim=-1)
+                break
+        else:
+            # The chat template already includes any special tokens
+            input_ids = self.tokenizer(
+                prompt_text, add_special_tokens=False, return_tensors="pt"
+            ).input_ids.to(self.model.device)
+        
+        if truncation and input_ids.shape[-1] > self.tokenizer.model_max_length:
+            input_ids = input_ids[:, :self.tokenizer.model_max_length]
+            self.prompt_token_cache = []
+        else:
+            self.prompt_token_cache = [(prompt_text, input_ids[0])]
+        return input_ids
+    
+    def get_reusable_cache(self, input_ids):
+        """Return the stored KV cache cut down to the prefix it shares with input_ids"""
+        if self.past_key_values is None or self.cached_input_ids is None:
+            self.past_key_values = DynamicCache()
+            return self.past_key_values
+        
+        # The last generated token is never in the cache, and at least one
+        # prompt token has to be left for the model to process
+        cached_ids = self.cached_input_ids
+        length = min(len(cached_ids), self.past_key_values.get_seq_length(), input_ids.shape[-1] - 1)
+        mismatch = (cached_ids[:length] != input_ids[0, :length]).nonzero()
+        if len(mismatch):
+            length = int(mismatch[0])
+        
+        if length > 0:
+            self.past_key_values.crop(length)
+        else:
+            self.past_key_values = DynamicCache()
+        return self.past_key_values
+    
+    def new_chat_history(self):
+        """Return the message list a new conversation starts with"""
+        if SYSTEM_PROMPT:
+            return [{"role": "system", "content": SYSTEM_PROMPT}]
+        return []
+    
+    def prefill_system_prompt(self):
+        """Run the system prompt through the model once and keep its KV cache"""
+        self.system_kv = None
+        self.system_ids = None
+        if not SYSTEM_PROMPT or not self.reuse_kv_cache:
+            return
         
-        # Schedule the update to be run in the main thread
-        self.window.after(0, update)
+        try:
+            system_history = self.new_chat_history()
+            system_text = self.tokenizer.apply_chat_template(system_history, tokenize=False)
+            
+            # Only usable if every prompt really starts with the system prompt's text
+            first_prompt = self.tokenizer.apply_chat_template(
+                system_history + [{"role": "user", "content": "Hi"}], tokenize=False, add_generation_prompt=True
+            )
+            if not first_prompt.startswith(system_text):
+                return
+            
+            system_ids = self.tokenizer(
+                system_text, add_special_tokens=False, return_tensors="pt"
+            ).input_ids.to(self.model.device)
+            with torch.inference_mode():
+                output = self.model(system_ids, past_key_values=DynamicCache(), use_cache=True)
+            self.system_kv = output.past_key_values
+            self.system_ids = system_ids[0]
+        except Exception as e:
+            print(f"System prompt prefill failed: {e}")
+    
+    def reset_kv_cache(self):
+        """Forget the KV cache kept between turns, back to just the system prompt if there is one"""
+        if self.system_kv is not None:
+            # The stored copy is never cropped or extended
+            self.past_key_values = copy.deepcopy(self.system_kv)
+            self.cached_input_ids = self.system_ids
+        else:
+            self.past_key_values = None
+            self.cached_input_ids = None
+    
+    def stop_generation(self, event=None):
+        """Stop the response currently being generated"""
+        self.cancel_event.set()
 
     def update_ui_with_status(self, status_message):
         """ Update the status bar with the provided message """
-        def update():
-            self.status_bar.config(text=status_message)
-        
-        # Schedule the update to be run in the main thread
-        self.window.after(0, update)
+        self.update_status(status_message)
 
     def trim_response(self, response_text):
         """ Post-process the response to trim unwanted parts """
-        # This is a placeholder; adjust the logic as needed for your application
+        # Generation already stops at the stop tokens, this is only a safety net
         trimmed_response = response_text.split("</s>")[0]  # Example: Take content before the first end-of-string token
         return trimmed_response
 
 
     def get_conversation_history_text(self):
-        """Retrieve text from the conversation history Text widget."""
-        return self.conversation_history.get("1.0", tk.END).strip()
+        """Build the conversation text from the chat history, without copying it out of Tk."""
+        return "\n".join(f"{message['role']}: {message['content']}" for message in self.chat_history)
 
     def get_chat_history(self):
         # Placeholder: Implement according to how you manage chat history.
@@ -548,18 +1217,45 @@ class WawaChatApplication:
         return self.chat_history  # Assuming self.chat_history is a list of message dictionaries.
 
     def update_status(self, message):
-        def update_message():
-            self.status_bar.config(text=message)
+        self.pending_status = message
         
-        self.window.after(0, update_message)
+        # One scheduled update shows whichever message is the latest by then
+        if not self.status_scheduled:
+            self.status_scheduled = True
+            self.window.after(0, self.flush_status)
+
+    def flush_status(self):
+        """Show the latest pending status message (main thread only)"""
+        self.status_scheduled = False
+        message, self.pending_status = self.pending_status, None
+        if message is not None:
+            self.status_bar.config(text=message)
 
     def clear_conversation(self):
-        self.conversation_history.config(state=tk.NORMAL)
+        self.pending_chunks.clear()
+        self.history_chars = 0
         self.conversation_history.delete('1.0', tk.END)
-        self.conversation_history.config(state=tk.DISABLED)
+        
+        # Drop the marks of the deleted messages
+        for number in self.message_marks:
+            self.conversation_history.mark_unset(f"msg_{number}_start", f"msg_{number}_end")
+        self.message_marks.clear()
+        self.stop_generation()
+        
+        # Start a new conversation, the model no longer sees the cleared messages
+        self.chat_history = self.new_chat_history()
+        self.reset_kv_cache()
 
+    def refresh_generation_parameters(self, *args):
+        """Rebuild the cached generation parameters after a setting changed (main thread only)"""
+        self.generation_kwargs = self.read_generation_parameters()
+    
     def get_generation_parameters(self):
-        """Collect generation parameters with Mac-optimized defaults"""
+        """Return a snapshot of the cached generation parameters"""
+        return dict(self.generation_kwargs)
+    
+    def read_generation_parameters(self):
+        """Collect generation parameters from the settings widgets with Mac-optimized defaults"""
         parameters = {}
         
         # Mac-optimized generation defaults
@@ -567,13 +1263,10 @@ class WawaChatApplication:
             "max_new_tokens": 30,      # Shorter responses for better performance
             "temperature": 0.7,        # Balance between creativity and determinism
             "top_p": 0.92,             # Slightly higher than default for better quality/speed balance
-            "num_beams": 1,            # Greedy decoding is much faster on Mac CPUs
             "repetition_penalty": 1.2, # Avoid repetitions without heavy penalties
             "use_cache": True,         # Enable KV-cache for faster generation
-            "early_stopping": True,    # Stop when conditions are met
             "do_sample": False,        # Deterministic generation is faster
             "truncation": True,        # Enable truncation
-            "pad_token_id": 0,         # Use 0 as padding token for compatibility
         }
         
         # Get values from UI with fallbacks to optimized defaults
@@ -581,7 +1274,7 @@ class WawaChatApplication:
             if self.include_settings[key].get():
                 try:
                     # Convert values to appropriate types
-                    if key == "max_new_tokens" or key == "num_beams":
+                    if key == "max_new_tokens":
                         parameters[key] = int(self.settings[key].get())
                     else:
                         parameters[key] = float(self.settings[key].get())
@@ -596,9 +1289,6 @@ class WawaChatApplication:
         if parameters.get("max_new_tokens", 0) > 75:  # Cap token generation
             parameters["max_new_tokens"] = 75
         
-        if parameters.get("num_beams", 1) > 2:  # Beam search is resource intensive
-            parameters["num_beams"] = 2
-        
         # Add optimization parameters not in the UI
         if "use_cache" not in parameters:
             parameters["use_cache"] = True
@@ -607,6 +1297,11 @@ class WawaChatApplication:
 
     def run(self):
         self.window.mainloop()
+        
+        # The window is gone, write any config change still waiting for its timer
+        if self.pending_config is not None:
+            self.config_version += 1
+            self.write_config(self.pending_config, self.config_version, report_errors=False)
 
 if __name__ == "__main__":
     app = WawaChatApplication()